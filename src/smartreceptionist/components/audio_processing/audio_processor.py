@@ -1,75 +1,233 @@
+import asyncio
+import concurrent.futures
+import functools
 import io
 import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
 
-import noisereduce as nr
 import numpy as np
 import soundfile as sf
-from pydub import AudioSegment
 from scipy import signal
 
 from ..config import Config
+from .denoisers import Denoiser, create_denoiser, select_denoiser
+from .transcoder import TranscoderPool
 
 
-class AudioProcessor:
+@functools.lru_cache(maxsize=16)
+def design_bandpass_filter(order: int, low_cutoff: float, high_cutoff: float, sample_rate: int) -> np.ndarray:
+    """
+    Butterworth high-pass and low-pass stacked into one float32 cascade of second-order sections, so a single sosfilt
+    pass gives the same result as running the two filters one after the other. Designed once per set of arguments.
+    """
+
+    high_pass = signal.butter(order, low_cutoff, "hp", fs=sample_rate, output="sos")
+    low_pass = signal.butter(order, high_cutoff, "lp", fs=sample_rate, output="sos")
+    # The array is shared between callers through the cache, so it must not be modified
+    return np.vstack([high_pass, low_pass]).astype(np.float32)
+
+
+class StageTimer:
+    """Time spent per stage, summed. Blocks of one clip are timed from several DSP threads at once, hence the lock."""
+
     def __init__(self):
+        self.timings: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+
+    def __str__(self):
+        return ", ".join(f"{stage} {seconds * 1000:.0f} ms" for stage, seconds in self.timings.items())
+
+
+class AudioProcessor:
+    # Denoise noise profiles are kept per source
+    SOURCE_BY_FORMAT = {"opus": "tg", "pcm": "esp", "wav": "wav"}
+
+    def __init__(
+        self,
+        max_workers: int = Config.AUDIO_DSP_WORKERS,
+        max_pending_jobs: int = Config.AUDIO_DSP_MAX_PENDING,
+        denoiser: Denoiser | None = None,
+        transcoder: TranscoderPool | None = None,
+    ):
         self.logger = logging.getLogger(__name__)
+        self.last_timings: dict[str, float] = {}
+        self.denoiser = denoiser or create_denoiser()
+        self._calibrate_denoiser = denoiser is None and Config.DENOISER_TIER == "auto"
+        self._calibration: asyncio.Task | None = None
+        self.transcoder = transcoder or TranscoderPool()
+
+        # DSP runs on its own threads so it never blocks the event loop. Jobs beyond max_pending_jobs wait for a slot.
+        self.dsp_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="audio-dsp")
+        self._dsp_slots = asyncio.Semaphore(max_pending_jobs)
+
+    async def run_dsp(self, func, *args):
+        loop = asyncio.get_running_loop()
+        async with self._dsp_slots:
+            return await loop.run_in_executor(self.dsp_pool, func, *args)
+
+    async def process_audio_blocks(self, input_bytes: bytes, input_format: str):
+        """
+        Yields the processed audio as 16-bit PCM blocks, each one as soon as it is denoised, so playback can start
+        before the whole clip is done. The first block is short to get audio out quickly. The gain comes from the peak
+        of the filtered audio, as denoising only takes energy away, instead of waiting for the denoised clip.
+        """
+
+        timer = StageTimer()
+        with timer.measure("decode"):
+            audio_data = await self.decode_async(input_bytes, input_format)
+        source = self.SOURCE_BY_FORMAT.get(input_format, input_format)
+        audio_data, gain = await self.run_dsp(self._filter_and_measure_sync, audio_data, source, timer)
+
+        first_block = int(Config.STREAM_FIRST_BLOCK_SECONDS * Config.SAMPLE_RATE)
+        block = int(Config.STREAM_DENOISE_BLOCK_SECONDS * Config.SAMPLE_RATE)
+        bounds = [0, *range(first_block, len(audio_data), block), len(audio_data)] if len(audio_data) else []
+
+        # All blocks are queued on the DSP pool at once and yielded in order
+        futures = [
+            asyncio.ensure_future(self.run_dsp(self._denoise_block_sync, audio_data, start, end, gain, source, timer))
+            for start, end in zip(bounds, bounds[1:])
+        ]
+        try:
+            for future in futures:
+                yield await future
+        finally:
+            for future in futures:
+                future.cancel()
+
+        self.last_timings = timer.timings
+        self.logger.info(f"Processed {input_format} audio in {len(futures)} blocks: {timer}")
+
+    def _filter_and_measure_sync(self, audio_data: np.ndarray, source: str, timer: StageTimer) -> tuple[np.ndarray, float]:
+        with timer.measure("filter"):
+            audio_data = self.apply_filters(audio_data)
+        with timer.measure("noise_profile"):
+            # Every clip comes from its own phone and room, so its noise is learned from the whole clip before the
+            # blocks are queued, instead of reusing an earlier clip's or whichever block runs first
+            self.denoiser.learn(audio_data, source)
+        with timer.measure("gain"):
+            gain = self.gain_for_peak(float(np.max(np.abs(audio_data), initial=0.0)), Config.TARGET_VOLUME)
+        return audio_data, gain
+
+    def _denoise_block_sync(
+        self, audio_data: np.ndarray, start: int, end: int, gain: float, source: str, timer: StageTimer
+    ) -> bytes:
+        # Same context overlap as AudioStream, the noise estimate gets some history before the block
+        context_start = max(0, start - int(Config.STREAM_DENOISE_CONTEXT_SECONDS * Config.SAMPLE_RATE))
+        with timer.measure("denoise"):
+            denoised = self.denoise(audio_data[context_start:end], source)[start - context_start :]
+        with timer.measure("encode"):
+            # Not in place, a passthrough denoiser returns a view of audio_data that other blocks still read
+            scaled = denoised * denoised.dtype.type(gain * 32767)
+            return np.clip(scaled, -32768, 32767).astype("<i2").tobytes()
+
+    async def decode_async(self, input_bytes: bytes, input_format: str) -> np.ndarray:
+        """Decodes in-process on the DSP pool, falling back to a warm ffmpeg process for files libsndfile can't read."""
 
-    async def process_audio(self, input_bytes: bytes, input_format: str) -> bytes:
         try:
-            if input_format == "opus":
-                # Convert Opus (Telegram) audio to 16kHz, mono
-                audio = AudioSegment.from_file(io.BytesIO(input_bytes), format="ogg", codec="opus")
-                audio = audio.set_frame_rate(Config.SAMPLE_RATE).set_channels(1)
-                audio_data = np.array(audio.get_array_of_samples(), dtype=np.float32) / 32768.0
-            elif input_format == "wav":
-                audio_data, _ = sf.read(io.BytesIO(input_bytes))
-            elif input_format == "pcm":
-                audio_data = AudioSegment.from_file(
-                    io.BytesIO(input_bytes),
-                    format="raw",
-                    frame_rate=Config.SAMPLE_RATE,
-                    channels=1,
-                    sample_width=Config.BIT_DEPTH // 8,
-                )
-                audio_data = np.array(audio_data.get_array_of_samples(), dtype=np.float32) / 32768.0
-            else:
-                raise ValueError(f"Unsupported input format: {input_format}")
-
-            processed_data = self.process_audio_data(audio_data)
-
-            output_buffer = io.BytesIO()
-            sf.write(output_buffer, processed_data, Config.SAMPLE_RATE, format="WAV", subtype="PCM_16")
-            return output_buffer.getvalue()
+            return await self.run_dsp(self.decode, input_bytes, input_format)
+        except RuntimeError as e:  # LibsndfileError is a RuntimeError
+            if input_format not in TranscoderPool.INPUT_PROFILES:
+                raise
+            self.logger.warning(f"In-process {input_format} decode failed, falling back to ffmpeg: {e}")
+            pcm = await self.transcoder.transcode(input_bytes, input_format)
+            return self.int16_to_float32(np.frombuffer(pcm, dtype="<i2"))
+
+    async def start(self) -> None:
+        await self.transcoder.start()
+        if self._calibrate_denoiser:
+            # Audio arriving meanwhile is denoised by the fast tier
+            self._calibration = asyncio.create_task(self._select_denoiser())
 
+    async def _select_denoiser(self) -> None:
+        try:
+            self.denoiser = await self.run_dsp(select_denoiser)
         except Exception as e:
-            self.logger.exception(f"Error processing audio: {e}")
-
-    def process_audio_data(self, audio_data: np.ndarray) -> np.ndarray:
-        # Apply high-pass filter
-        sos = signal.butter(5, 50, "hp", fs=Config.SAMPLE_RATE, output="sos")
-        audio_data = signal.sosfilt(sos, audio_data)
-
-        # Apply low-pass filter
-        sos = signal.butter(5, 7000, "lp", fs=Config.SAMPLE_RATE, output="sos")
-        audio_data = signal.sosfilt(sos, audio_data)
-
-        # Noise reduction
-        audio_data = nr.reduce_noise(
-            y=audio_data,
-            sr=Config.SAMPLE_RATE,
-            prop_decrease=0.7,
-            time_constant_s=2.0,
-            freq_mask_smooth_hz=100,
-            n_std_thresh_stationary=1.5,
-        )
-
-        # Auto gain
-        audio_data = self.auto_gain(audio_data, target_level=Config.TARGET_VOLUME)
+            self.logger.error(f"Denoiser calibration failed, keeping the {self.denoiser.name} tier: {e}")
+
+    async def close(self) -> None:
+        if self._calibration:
+            self._calibration.cancel()
+        await self.transcoder.close()
+        self.dsp_pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def decode(input_bytes: bytes, input_format: str) -> np.ndarray:
+        """Decodes to mono float32 samples at Config.SAMPLE_RATE."""
+
+        if input_format in ("opus", "wav"):
+            # Telegram voice notes are Ogg/Opus, which libsndfile 1.0.29+ decodes in-process
+            return AudioProcessor.decode_soundfile(input_bytes)
+        elif input_format == "pcm":
+            return AudioProcessor.int16_to_float32(np.frombuffer(input_bytes, dtype="<i2"))
+        else:
+            raise ValueError(f"Unsupported input format: {input_format}")
+
+    @staticmethod
+    def decode_soundfile(input_bytes: bytes) -> np.ndarray:
+        audio_data, sample_rate = sf.read(io.BytesIO(input_bytes), dtype="float32")
+        if audio_data.ndim > 1:
+            audio_data = audio_data.mean(axis=1, dtype=np.float32)
+        return AudioProcessor.resample(audio_data, sample_rate)
+
+    @staticmethod
+    def resample(audio_data: np.ndarray, sample_rate: int) -> np.ndarray:
+        """Polyphase resampling to Config.SAMPLE_RATE, e.g. 48 kHz Opus is 1 up, 3 down."""
 
+        if sample_rate == Config.SAMPLE_RATE:
+            return audio_data
+        divisor = math.gcd(sample_rate, Config.SAMPLE_RATE)
+        resampled = signal.resample_poly(audio_data, Config.SAMPLE_RATE // divisor, sample_rate // divisor)
+        return resampled.astype(np.float32, copy=False)
+
+    @staticmethod
+    def int16_to_float32(samples: np.ndarray) -> np.ndarray:
+        # One float32 allocation, scaled in place
+        audio_data = samples.astype(np.float32)
+        audio_data *= 1 / 32768.0
         return audio_data
 
+    @staticmethod
+    def bandpass_filter() -> np.ndarray:
+        return design_bandpass_filter(5, 50, 7000, Config.SAMPLE_RATE)
+
+    def apply_filters(self, audio_data: np.ndarray) -> np.ndarray:
+        # float32 samples and coefficients keep sosfilt in float32, with a single working copy
+        return signal.sosfilt(self.bandpass_filter(), audio_data.astype(np.float32, copy=False))
+
+    def denoise(self, audio_data: np.ndarray, source: str = "default") -> np.ndarray:
+        return self.denoiser.denoise(audio_data, source)
+
+    def reset_noise_profile(self, source: str | None = None) -> None:
+        """Call when a device (re)connects, its noise may have changed."""
+        self.denoiser.reset(source)
+
+    @staticmethod
+    def encode_wav(audio_data: np.ndarray) -> bytes:
+        output_buffer = io.BytesIO()
+        sf.write(output_buffer, audio_data, Config.SAMPLE_RATE, format="WAV", subtype="PCM_16")
+        return output_buffer.getvalue()
+
+    @staticmethod
+    def gain_for_peak(peak: float, target_level=-5.0) -> float:
+        if peak <= 0:
+            return 1.0  # Silence
+        current_level = 20 * np.log10(peak)
+        return 10 ** ((target_level - current_level) / 20)
+
     @staticmethod
     def auto_gain(audio_data: np.ndarray, target_level=-5.0) -> np.ndarray:
-        current_level = 20 * np.log10(np.max(np.abs(audio_data)))
-        gain_factor = 10 ** ((target_level - current_level) / 20)
-        return audio_data * gain_factor
+        gain_factor = AudioProcessor.gain_for_peak(np.max(np.abs(audio_data)), target_level)
+        return audio_data * audio_data.dtype.type(gain_factor)
@@ -1,31 +1,64 @@
-import asyncio
 import logging
 
+from ..config import Config
+from .audio_processor import AudioProcessor
+from .audio_stream import AudioStream
+
 
 class AudioQueue:
-    def __init__(self):
+    def __init__(
+        self,
+        audio_processor: AudioProcessor,
+        max_recording_bytes: int = Config.MAX_RECORDING_BYTES,
+    ):
         self.logger = logging.getLogger(__name__)
-        self._audio_chunk_queue = asyncio.Queue()
+        self.audio_processor = audio_processor
+        self.max_recording_bytes = max_recording_bytes
+
+        # Chunks go straight into the stream, only the recorded size is kept for the cap
+        self._size = 0
+
+        # Processes the recording incrementally as chunks arrive
+        self._stream = AudioStream(audio_processor)
+
+        self.chunks_received = 0
+        self.chunks_dropped = 0
+        self.bytes_dropped = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def add_audio_chunk_nowait(self, audio_chunk: bytes | memoryview) -> bool:
+        """Feeds the chunk to the stream right away, in the order of the calls. Returns False if it was dropped."""
+
+        if not isinstance(audio_chunk, (bytes, memoryview)):
+            raise TypeError("Audio chunk must be of type bytes or memoryview")
 
-    async def add_audio_chunk(self, audio_chunk: bytes) -> None:
-        if not isinstance(audio_chunk, bytes):
-            raise TypeError("Audio chunk must be of type bytes")
+        self.chunks_received += 1
+        chunk_size = len(audio_chunk)
+        end = self._size + chunk_size
 
-        try:
-            await self._audio_chunk_queue.put(audio_chunk)
-        except asyncio.QueueFull:
-            self.logger.warning("Audio chunk queue is full. Dropping chunk.")
+        if end > self.max_recording_bytes:
+            if not self.chunks_dropped:
+                self.logger.warning(f"Recording reached the {self.max_recording_bytes} byte limit. Dropping further chunks.")
+            self.chunks_dropped += 1
+            self.bytes_dropped += chunk_size
+            return False
 
-    async def get_audio_data(self) -> bytes:
-        audio_data = b""
+        self._size = end
+        self._stream.feed(audio_chunk)
+        return True
 
-        while not self._audio_chunk_queue.empty():
-            chunk = await self._audio_chunk_queue.get()
-            audio_data += chunk
+    async def get_processed_audio(self) -> bytes:
+        """Returns the processed recording as WAV. Most of the work was already done while the chunks were arriving."""
 
-        self.logger.info(f"Retrieved {len(audio_data)} bytes of audio data.")
-        return audio_data
+        return await self._stream.finish()
 
     async def cleanup(self):
-        self._audio_chunk_queue = asyncio.Queue()
+        self._size = 0
+        self._stream = AudioStream(self.audio_processor)
+        self.chunks_received = 0
+        self.chunks_dropped = 0
+        self.bytes_dropped = 0
         self.logger.info("Audio queue cleaned up.")
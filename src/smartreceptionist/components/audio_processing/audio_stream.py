@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+
+import numpy as np
+from scipy import signal
+
+from ..config import Config
+from .audio_processor import AudioProcessor, StageTimer
+
+
+class AudioStream:
+    """
+    Processes an ESP recording while it is still being received. Chunks are filtered as they arrive, carrying the filter
+    state between them, and denoised in blocks in the background. Once the recording stops, only the remaining tail,
+    the global gain and the WAV encoding are left to do.
+    """
+
+    def __init__(
+        self,
+        audio_processor: AudioProcessor,
+        block_seconds: float = Config.STREAM_DENOISE_BLOCK_SECONDS,
+        context_seconds: float = Config.STREAM_DENOISE_CONTEXT_SECONDS,
+    ):
+        self.audio_processor = audio_processor
+        self.logger = logging.getLogger(__name__)
+
+        self._sos = audio_processor.bandpass_filter()
+        self._filter_state = np.zeros((self._sos.shape[0], 2), dtype=np.float32)
+        self._remainder = b""  # Half a sample left over when a chunk has an odd length
+
+        self._block_size = int(block_seconds * Config.SAMPLE_RATE)
+        self._context_size = int(context_seconds * Config.SAMPLE_RATE)
+        self._filtered: list[np.ndarray] = []  # Filtered samples waiting for a full denoise block
+        self._filtered_size = 0
+        self._context = np.zeros(0, dtype=np.float32)
+        self._denoised_blocks: list[asyncio.Future] = []  # In recording order
+
+        self.samples_received = 0
+        self.timer = StageTimer()  # Accumulated over the whole recording
+
+    def feed(self, chunk: bytes | memoryview) -> None:
+        if self._remainder:
+            chunk = self._remainder + bytes(chunk)
+        usable = len(chunk) - len(chunk) % 2
+        self._remainder = bytes(chunk[usable:])
+        if not usable:
+            return
+
+        with self.timer.measure("decode"):
+            audio_data = AudioProcessor.int16_to_float32(np.frombuffer(chunk, dtype="<i2", count=usable // 2))
+        with self.timer.measure("filter"):
+            audio_data, self._filter_state = signal.sosfilt(self._sos, audio_data, zi=self._filter_state)
+
+        self.samples_received += len(audio_data)
+        self._filtered.append(audio_data)
+        self._filtered_size += len(audio_data)
+
+        while self._filtered_size >= self._block_size:
+            self._submit_block(self._take(self._block_size))
+
+    def _take(self, size: int) -> np.ndarray:
+        filtered = np.concatenate(self._filtered) if len(self._filtered) > 1 else self._filtered[0]
+        block, rest = filtered[:size], filtered[size:]
+        self._filtered = [rest] if len(rest) else []
+        self._filtered_size = len(rest)
+        return block
+
+    def _submit_block(self, block: np.ndarray) -> None:
+        # The noise estimate needs some history, so each block is denoised together with the end of the previous one
+        # and that overlap is cut off again afterwards.
+        context_size = len(self._context)
+        padded = np.concatenate([self._context, block]) if context_size else block
+        self._context = block[-self._context_size :] if self._context_size else self._context
+
+        self._denoised_blocks.append(
+            asyncio.ensure_future(self.audio_processor.run_dsp(self._denoise_block, padded, context_size))
+        )
+
+    def _denoise_block(self, padded: np.ndarray, context_size: int) -> np.ndarray:
+        with self.timer.measure("denoise"):
+            return self.audio_processor.denoise(padded, "esp")[context_size:]
+
+    async def finish(self) -> bytes:
+        start = time.perf_counter()
+
+        if self._filtered_size:
+            self._submit_block(self._take(self._filtered_size))
+
+        blocks = await asyncio.gather(*self._denoised_blocks)
+        wav = await self.audio_processor.run_dsp(self._finish_sync, blocks)
+
+        self.logger.info(
+            f"Finished processing {self.samples_received / Config.SAMPLE_RATE:.1f}s of streamed audio "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms after the recording stopped ({self.timer})."
+        )
+        return wav
+
+    def _finish_sync(self, blocks: list[np.ndarray]) -> bytes:
+        audio_data = np.concatenate(blocks) if blocks else np.zeros(0, dtype=np.float32)
+        with self.timer.measure("gain"):
+            audio_data = AudioProcessor.auto_gain(audio_data, target_level=Config.TARGET_VOLUME)
+        with self.timer.measure("encode"):
+            return self.audio_processor.encode_wav(audio_data)
@@ -0,0 +1,166 @@
+import logging
+import time
+from abc import ABC, abstractmethod
+
+import noisereduce as nr
+import numpy as np
+from scipy import ndimage, signal
+
+from ..config import Config
+
+
+class Denoiser(ABC):
+    name = "base"
+
+    @abstractmethod
+    def denoise(self, audio_data: np.ndarray, source: str = "default") -> np.ndarray: ...
+
+    def reset(self, source: str | None = None) -> None:
+        """Forgets anything learned about a source's noise, or about all sources."""
+
+    def learn(self, audio_data: np.ndarray, source: str = "default") -> None:
+        """Learns a source's noise from a whole clip, replacing what was learned before."""
+
+
+class PassthroughDenoiser(Denoiser):
+    name = "off"
+
+    def denoise(self, audio_data: np.ndarray, source: str = "default") -> np.ndarray:
+        return audio_data
+
+
+class NoiseReduceDenoiser(Denoiser):
+    """Non-stationary noisereduce, the best sounding and by far the most expensive tier."""
+
+    name = "quality"
+
+    def denoise(self, audio_data: np.ndarray, source: str = "default") -> np.ndarray:
+        denoised = nr.reduce_noise(
+            y=audio_data,
+            sr=Config.SAMPLE_RATE,
+            prop_decrease=0.7,
+            time_constant_s=2.0,
+            freq_mask_smooth_hz=100,
+            n_std_thresh_stationary=1.5,
+        )
+        return denoised.astype(np.float32, copy=False)
+
+
+class SpectralGateDenoiser(Denoiser):
+    """
+    Stationary spectral gate. The noise profile (mean and spread of each frequency bin, in dB) is learned from the
+    quietest frames of the first clip seen from a source and reused for every later clip from it, until reset or
+    relearned with learn().
+    """
+
+    name = "fast"
+
+    def __init__(
+        self,
+        n_fft: int = 512,
+        n_std_thresh: float = 1.5,
+        prop_decrease: float = 0.7,
+        noise_quantile: float = 0.1,
+        smooth_bins: int = 3,
+        smooth_frames: int = 5,
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.n_fft = n_fft
+        self.n_std_thresh = n_std_thresh
+        self.prop_decrease = prop_decrease
+        self.noise_quantile = noise_quantile
+        self.smooth_size = (smooth_bins, smooth_frames)
+        self._noise_thresholds: dict[str, np.ndarray] = {}
+
+    def _learn_noise_threshold(self, magnitude_db: np.ndarray, source: str) -> np.ndarray:
+        frame_energy = magnitude_db.mean(axis=0)
+        quiet_frames = magnitude_db[:, frame_energy <= np.quantile(frame_energy, self.noise_quantile)]
+        threshold = quiet_frames.mean(axis=1) + self.n_std_thresh * quiet_frames.std(axis=1)
+        self._noise_thresholds[source] = threshold[:, np.newaxis]
+        self.logger.info(f"Learned noise profile for {source} audio from {quiet_frames.shape[1]} frames.")
+        return self._noise_thresholds[source]
+
+    def _stft(self, audio_data: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        _, _, spectrum = signal.stft(audio_data, fs=Config.SAMPLE_RATE, nperseg=self.n_fft, noverlap=self.n_fft * 3 // 4)
+        return spectrum, 20 * np.log10(np.abs(spectrum) + 1e-10)
+
+    def learn(self, audio_data: np.ndarray, source: str = "default") -> None:
+        if len(audio_data) < self.n_fft:
+            self.reset(source)
+            return
+        self._learn_noise_threshold(self._stft(audio_data)[1], source)
+
+    def denoise(self, audio_data: np.ndarray, source: str = "default") -> np.ndarray:
+        if len(audio_data) < self.n_fft:
+            return audio_data
+
+        noverlap = self.n_fft * 3 // 4
+        spectrum, magnitude_db = self._stft(audio_data)
+
+        threshold = self._noise_thresholds.get(source)
+        if threshold is None:
+            threshold = self._learn_noise_threshold(magnitude_db, source)
+
+        # Soft mask: bins above the noise threshold pass, the rest are attenuated by prop_decrease
+        mask = ndimage.uniform_filter((magnitude_db > threshold).astype(np.float32), size=self.smooth_size)
+        spectrum *= 1 - self.prop_decrease * (1 - mask)
+
+        _, denoised = signal.istft(spectrum, fs=Config.SAMPLE_RATE, nperseg=self.n_fft, noverlap=noverlap)
+        return denoised[: len(audio_data)].astype(np.float32, copy=False)
+
+    def reset(self, source: str | None = None) -> None:
+        if source is None:
+            self._noise_thresholds.clear()
+        else:
+            self._noise_thresholds.pop(source, None)
+
+
+# Best sounding first
+DENOISER_TIERS: dict[str, type[Denoiser]] = {
+    NoiseReduceDenoiser.name: NoiseReduceDenoiser,
+    SpectralGateDenoiser.name: SpectralGateDenoiser,
+    PassthroughDenoiser.name: PassthroughDenoiser,
+}
+
+
+def measure_real_time_factor(denoiser: Denoiser, seconds: float = 2.0) -> float:
+    """Seconds of CPU needed per second of audio, measured on synthetic noise."""
+
+    audio_data = np.random.default_rng(0).normal(0, 0.05, int(seconds * Config.SAMPLE_RATE)).astype(np.float32)
+    # Warm-up, so one-off costs (imports, FFT plans, allocations) don't count against the tier
+    denoiser.denoise(audio_data[: Config.SAMPLE_RATE // 4], source="calibration")
+    denoiser.reset("calibration")
+
+    start = time.perf_counter()
+    denoiser.denoise(audio_data, source="calibration")
+    denoiser.reset("calibration")
+    return (time.perf_counter() - start) / seconds
+
+
+def create_denoiser(tier: str = Config.DENOISER_TIER) -> Denoiser:
+    """Creates the denoiser for a tier name. "auto" starts with the fast tier until select_denoiser() has run."""
+
+    if tier == "auto":
+        return SpectralGateDenoiser()
+    if tier not in DENOISER_TIERS:
+        raise ValueError(f"Unknown denoiser tier: {tier}")
+    return DENOISER_TIERS[tier]()
+
+
+def select_denoiser(cpu_budget: float = Config.AUDIO_CPU_BUDGET) -> Denoiser:
+    """
+    Picks the best sounding tier whose measured real-time factor fits in cpu_budget, falling back to the fast tier if
+    none does. Takes a few seconds of CPU, so it shouldn't run on the event loop.
+    """
+
+    logger = logging.getLogger(__name__)
+
+    for denoiser_class in DENOISER_TIERS.values():
+        denoiser = denoiser_class()
+        real_time_factor = measure_real_time_factor(denoiser)
+        if real_time_factor <= cpu_budget:
+            logger.info(f"Using {denoiser.name} denoiser (real-time factor {real_time_factor:.3f}, budget {cpu_budget}).")
+            return denoiser
+
+    logger.warning(f"No denoiser fits the CPU budget of {cpu_budget}, using the fast tier.")
+    return SpectralGateDenoiser()
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from asyncio.subprocess import Process
+from shutil import which
+
+from ..config import Config
+
+
+class TranscoderPool:
+    """
+    Warm ffmpeg processes that convert audio to s16le mono at Config.SAMPLE_RATE over stdin/stdout.
+
+    ffmpeg converts a single stream per process and only flushes it once stdin is closed, so every process serves one
+    job. What the pool saves is the start-up: each job gets an already running process, and its replacement is started
+    in the background right after, off the request path. Dead processes are replaced before use, and a job that runs
+    past job_timeout has its process killed.
+    """
+
+    # Input options per AudioProcessor format, ffmpeg detects the codec inside the container
+    INPUT_PROFILES = {
+        "opus": ["-f", "ogg"],
+        "wav": ["-f", "wav"],
+    }
+
+    def __init__(
+        self,
+        processes_per_profile: int = Config.TRANSCODER_PROCESSES,
+        job_timeout: float = Config.TRANSCODER_JOB_TIMEOUT,
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.processes_per_profile = processes_per_profile
+        self.job_timeout = job_timeout
+        self._idle: dict[str, list[Process]] = {profile: [] for profile in self.INPUT_PROFILES}
+        self._starting: dict[str, int] = {profile: 0 for profile in self.INPUT_PROFILES}
+        self._spawn_tasks: set[asyncio.Task] = set()
+        self._closed = False
+
+    @staticmethod
+    def _command(profile: str) -> list[str]:
+        return [
+            "ffmpeg",
+            "-hide_banner",
+            "-loglevel",
+            "error",
+            *TranscoderPool.INPUT_PROFILES[profile],
+            "-i",
+            "pipe:0",
+            "-f",
+            "s16le",
+            "-ac",
+            "1",
+            "-ar",
+            str(Config.SAMPLE_RATE),
+            "pipe:1",
+        ]
+
+    async def _spawn(self, profile: str) -> Process:
+        return await asyncio.create_subprocess_exec(
+            *self._command(profile),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+
+    async def _refill(self, profile: str) -> None:
+        while not self._closed and len(self._idle[profile]) + self._starting[profile] < self.processes_per_profile:
+            self._starting[profile] += 1
+            try:
+                process = await self._spawn(profile)
+            finally:
+                self._starting[profile] -= 1
+            self._idle[profile].append(process)
+
+    def _schedule_refill(self, profile: str) -> None:
+        task = asyncio.create_task(self._refill(profile))
+        self._spawn_tasks.add(task)
+        task.add_done_callback(self._spawn_tasks.discard)
+
+    async def start(self) -> None:
+        if not which("ffmpeg"):
+            self.logger.warning("ffmpeg was not found in PATH, audio that can't be decoded in-process will fail.")
+            return
+        await asyncio.gather(*(self._refill(profile) for profile in self.INPUT_PROFILES))
+        self.logger.info(f"Started {self.processes_per_profile} ffmpeg transcoder(s) per input format.")
+
+    async def _acquire(self, profile: str) -> Process:
+        idle = self._idle[profile]
+        while idle:
+            process = idle.pop()
+            if process.returncode is None:
+                return process
+            self.logger.warning(f"Replacing {profile} transcoder that exited with code {process.returncode}.")
+        # None warm (first use, or jobs arriving faster than replacements start), pay the start-up once
+        return await self._spawn(profile)
+
+    async def transcode(self, input_bytes: bytes, input_format: str) -> bytes:
+        """Returns s16le mono samples at Config.SAMPLE_RATE."""
+
+        if input_format not in self.INPUT_PROFILES:
+            raise ValueError(f"Unsupported input format: {input_format}")
+        if not which("ffmpeg"):
+            raise RuntimeError("FFmpeg is not installed or not found in your PATH.")
+
+        process = await self._acquire(input_format)
+        self._schedule_refill(input_format)
+
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(input=input_bytes), timeout=self.job_timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise RuntimeError(f"FFmpeg timed out after {self.job_timeout}s transcoding {input_format} audio")
+        except BaseException:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            raise
+
+        if process.returncode != 0:
+            raise RuntimeError(f"FFmpeg error: {stderr.decode(errors='replace').strip()}")
+
+        return stdout
+
+    async def close(self) -> None:
+        self._closed = True
+        for task in list(self._spawn_tasks):
+            task.cancel()
+        await asyncio.gather(*self._spawn_tasks, return_exceptions=True)
+
+        for processes in self._idle.values():
+            for process in processes:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+            processes.clear()
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import AsyncIterable, Awaitable, Callable, Iterable
+
+from .config import Config
+
+
+@dataclass
+class AudioStreamStats:
+    chunks_sent: int = 0
+    bytes_sent: int = 0
+    elapsed: float = 0.0  # Seconds from the first chunk to the last
+    first_chunk_at: float | None = None  # time.monotonic() when the first chunk was sent
+    max_jitter: float = 0.0  # Seconds a paced chunk was sent after its due time
+    total_jitter: float = 0.0
+    paced_chunks: int = 0
+    underruns: int = 0  # Times the device buffer is estimated to have run dry
+    acks: int = 0
+    ack_waits: int = 0  # Times sending paused for the device to acknowledge
+    ack_timeouts: int = 0
+
+    @property
+    def audio_seconds(self) -> float:
+        return self.bytes_sent / (Config.SAMPLE_RATE * Config.BYTES_PER_SAMPLE)
+
+    @property
+    def mean_jitter(self) -> float:
+        return self.total_jitter / self.paced_chunks if self.paced_chunks else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.audio_seconds:.1f}s of audio in {self.elapsed:.1f}s, {self.chunks_sent} chunks, "
+            f"jitter mean {self.mean_jitter * 1000:.1f} ms / max {self.max_jitter * 1000:.1f} ms, "
+            f"{self.underruns} underruns, {self.acks} acks, {self.ack_waits} ack waits ({self.ack_timeouts} timed out)"
+        )
+
+
+class AudioStreamer:
+    """
+    Streams 16-bit mono PCM to a device at playback speed. The first target_buffer_ms of audio is sent straight away to
+    fill the device buffer, after that each chunk is sent when the buffer would drop back to that depth, measured on the
+    monotonic clock from the start of the stream.
+
+    If the device acknowledges what it has received ({"action": "ack", "bytes": <total>}), at most max_unacked_ms of
+    audio is kept unacknowledged. Devices that never ack are paced on the clock alone.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[bytes], Awaitable],
+        chunk_size: int = Config.DEFAULT_CHUNK_SIZE,
+        target_buffer_ms: int = Config.STREAM_TARGET_BUFFER_MS,
+        max_unacked_ms: int = Config.STREAM_MAX_UNACKED_MS,
+        ack_timeout: float = Config.STREAM_ACK_TIMEOUT,
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.send = send
+        self.bytes_per_second = Config.SAMPLE_RATE * Config.BYTES_PER_SAMPLE
+        self.chunk_size = chunk_size - chunk_size % Config.BYTES_PER_SAMPLE  # Never split a sample
+        self.target_buffer = target_buffer_ms / 1000
+        self.max_unacked_bytes = max_unacked_ms * self.bytes_per_second // 1000
+        self.ack_timeout = ack_timeout
+
+        self.stats = AudioStreamStats()
+        self._acked_bytes: int | None = None  # None until the device sends its first ack
+        self._ack_received = asyncio.Event()
+
+    def handle_ack(self, data: dict) -> None:
+        acked_bytes = data.get("bytes")
+        if not isinstance(acked_bytes, int):
+            self.logger.warning(f"Invalid audio ack: {data}")
+            return
+        self.stats.acks += 1
+        self._acked_bytes = max(acked_bytes, self._acked_bytes or 0)
+        self._ack_received.set()
+
+    async def _wait_for_ack_window(self) -> None:
+        while self._acked_bytes is not None and self.stats.bytes_sent - self._acked_bytes > self.max_unacked_bytes:
+            self.stats.ack_waits += 1
+            self._ack_received.clear()
+            try:
+                await asyncio.wait_for(self._ack_received.wait(), timeout=self.ack_timeout)
+            except asyncio.TimeoutError:
+                # Don't stall forever on a lost ack, fall back to clock pacing
+                self.stats.ack_timeouts += 1
+                self.logger.warning("Timed out waiting for an audio ack from the device.")
+                return
+
+    @staticmethod
+    async def _iterate(blocks: AsyncIterable[bytes] | Iterable[bytes]):
+        if isinstance(blocks, AsyncIterable):
+            async for block in blocks:
+                yield block
+        else:
+            for block in blocks:
+                yield block
+
+    async def _rechunk(self, blocks: AsyncIterable[bytes] | Iterable[bytes]):
+        pending = bytearray()
+        async for block in self._iterate(blocks):
+            pending += block
+            while len(pending) >= self.chunk_size:
+                yield bytes(pending[: self.chunk_size])
+                del pending[: self.chunk_size]
+        if len(pending) >= Config.BYTES_PER_SAMPLE:
+            yield bytes(pending[: len(pending) - len(pending) % Config.BYTES_PER_SAMPLE])
+
+    async def stream(self, blocks: AsyncIterable[bytes] | Iterable[bytes]) -> AudioStreamStats:
+        """Sends PCM blocks of any size, re-cut into chunk_size chunks, and returns the stream statistics."""
+
+        start = None
+        async for chunk in self._rechunk(blocks):
+            now = time.monotonic()
+            if start is None:
+                start = now
+
+            # Audio the device still has buffered, assuming playback started with the first chunk
+            sent_seconds = self.stats.bytes_sent / self.bytes_per_second
+            buffered = sent_seconds - (now - start)
+            if buffered < 0 and self.stats.chunks_sent:
+                # The device ran dry (the source couldn't keep up), playback resumes once this chunk arrives
+                self.stats.underruns += 1
+                start -= buffered
+
+            # Send when the device buffer is back down to the target depth
+            due = start + sent_seconds - self.target_buffer
+            if now < due:
+                await asyncio.sleep(due - now)
+                jitter = time.monotonic() - due
+                self.stats.paced_chunks += 1
+                self.stats.max_jitter = max(self.stats.max_jitter, jitter)
+                self.stats.total_jitter += jitter
+
+            await self._wait_for_ack_window()
+            await self.send(chunk)
+            if self.stats.first_chunk_at is None:
+                self.stats.first_chunk_at = time.monotonic()
+            self.stats.chunks_sent += 1
+            self.stats.bytes_sent += len(chunk)
+
+        if start is not None:
+            self.stats.elapsed = time.monotonic() - start
+        return self.stats
@@ -33,6 +33,45 @@ class Config:
     TARGET_VOLUME = 1
     SAMPLE_RATE = 16000
     BIT_DEPTH = 16
+    MAX_RECORDING_BYTES = SAMPLE_RATE * BYTES_PER_SAMPLE * 10 * 60  # 10 minutes, later chunks are dropped
+    AUDIO_DSP_WORKERS = 2  # Threads for filtering, noise reduction and encoding
+    AUDIO_DSP_MAX_PENDING = 8  # DSP jobs queued or running at once, further jobs wait for a slot
+    STREAM_DENOISE_BLOCK_SECONDS = 5.0  # ESP recordings are denoised in blocks of this length while still recording
+    STREAM_DENOISE_CONTEXT_SECONDS = 1.0  # Audio from the previous block used to warm up the noise estimate
+    DENOISER_TIER = os.getenv("DENOISER_TIER", "auto")  # quality (noisereduce), fast (spectral gate), off, or auto
+    AUDIO_CPU_BUDGET = float(os.getenv("AUDIO_CPU_BUDGET", "0.25"))  # Max denoise seconds per second of audio for auto
+    STREAM_FIRST_BLOCK_SECONDS = 1.0  # Telegram audio is played while processing, a short first block starts it sooner
+    STREAM_TARGET_BUFFER_MS = 500  # Audio kept buffered on the ESP32-S3 while streaming to its speaker
+    STREAM_MAX_UNACKED_MS = 1500  # Audio sent but not yet acknowledged, once the device sends acks
+    STREAM_ACK_TIMEOUT = 2.0  # Seconds to wait for an ack before carrying on without it
+    TRANSCODER_PROCESSES = 1  # Warm ffmpeg processes per input format, for audio that can't be decoded in-process
+    TRANSCODER_JOB_TIMEOUT = 30.0  # Seconds before a stuck ffmpeg process is killed
+
+    FACE_MODEL_PATH = "yolov8n-face.pt"
+    DETECTION_WORKERS = int(os.getenv("DETECTION_WORKERS", "1"))  # Face detection processes, one model copy each
+    MAX_FRAMES_IN_FLIGHT = int(os.getenv("MAX_FRAMES_IN_FLIGHT", "4"))  # Frames submitted to the pool but not yet returned
+    DETECTION_INPUT_SIZE = 640  # Longest side frames are downscaled to for detection, 0 runs it on the full resolution
+    FACE_REGION_MARGIN = 0.25  # Enhance only the faces grown by this fraction of their size, None enhances the whole frame
+    FRAME_DIFF_THRESHOLD = 3.0  # Grey levels between thumbnails under which a frame repeats the previous one, 0 disables
+    FRAME_DIFF_THUMBNAIL_SIZE = 16
+    CAM_MAX_FRAME_SIZE = 4 * 1024 * 1024  # Largest message accepted from the camera, high-resolution captures included
+    FRAME_SLOT_SIZE = CAM_MAX_FRAME_SIZE  # Shared memory per in-flight frame, so every frame the camera may send fits
+    DETECTION_BATCH_SIZE = 4  # Max frames per batched model call
+    DETECTION_BATCH_WAIT_MS = 50  # How long to wait for more frames after the first one of a batch arrives
+    MAX_ENHANCE_JOBS = 2  # Concurrent enhancement jobs for images captured outside a motion session
+
+    AUDIO_REORDER_WINDOW = 8  # Binary protocol audio frames held back waiting for a missing one before it counts as lost
+    WS_SEND_TIMEOUT = 5.0  # Seconds a send to one device socket may take before it is given up on
+
+    CONTROL_LANE_SIZE = 100  # Queued commands, producers wait when full
+    DETECTION_LANE_SIZE = 50  # Queued motion and person triggers, producers wait when full
+    BULK_LANE_SIZE = 16  # Queued images and voice notes, further ones are dropped
+
+    MEDIA_DIR = "media"
+    MEDIA_DB_PATH = "media/media.db"  # Index of saved images and audio
+    MEDIA_RETENTION_DAYS = 30  # Saved media older than this is deleted
+    MEDIA_MAX_ENTRIES = 1000  # Per media type and origin, the oldest are deleted beyond this
+    MEDIA_RETENTION_INTERVAL = 60 * 60  # Seconds between retention runs
 
     @staticmethod
     def validate():
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+
+from websockets import ConnectionClosed, WebSocketServerProtocol
+
+from .config import Config
+
+
+@dataclass
+class ConnectionStats:
+    started_at: float = field(default_factory=time.monotonic)
+    messages_in: int = 0
+    bytes_in: int = 0
+    messages_out: int = 0
+    bytes_out: int = 0
+
+    def record_in(self, size: int) -> None:
+        self.messages_in += 1
+        self.bytes_in += size
+
+    def record_out(self, size: int) -> None:
+        self.messages_out += 1
+        self.bytes_out += size
+
+    @property
+    def throughput_in(self) -> float:
+        """Bytes per second received since the connection opened."""
+        return self.bytes_in / max(time.monotonic() - self.started_at, 1e-6)
+
+    @property
+    def throughput_out(self) -> float:
+        return self.bytes_out / max(time.monotonic() - self.started_at, 1e-6)
+
+    def __str__(self):
+        return (
+            f"{self.messages_in} in ({self.throughput_in / 1024:.1f} KB/s), "
+            f"{self.messages_out} out ({self.throughput_out / 1024:.1f} KB/s)"
+        )
+
+
+@dataclass
+class DeviceConnection:
+    websocket: WebSocketServerProtocol
+    name: str  # Device role, "esp_cam" or "esp_s3"
+    device_id: str | None = None
+    connected_at: float = field(default_factory=time.monotonic)
+    stats: ConnectionStats = field(default_factory=ConnectionStats)
+
+    @property
+    def rtt(self) -> float:
+        """Round trip time in seconds, from the last keepalive ping."""
+        return self.websocket.latency
+
+
+class DeviceRegistry:
+    """
+    Connected devices, indexed by name (several sockets can share one), by device ID, and by socket. Every lookup is a
+    dict access. broadcast() sends one already serialized payload to all sockets of a device concurrently, each with its
+    own timeout, so a stuck socket can't hold up the others.
+    """
+
+    def __init__(self, send_timeout: float = Config.WS_SEND_TIMEOUT):
+        self.logger = logging.getLogger(__name__)
+        self.send_timeout = send_timeout
+        self._by_socket: dict[WebSocketServerProtocol, DeviceConnection] = {}
+        self._by_name: dict[str, dict[WebSocketServerProtocol, DeviceConnection]] = {}
+        self._by_id: dict[str, DeviceConnection] = {}
+
+    def add(
+        self,
+        websocket: WebSocketServerProtocol,
+        name: str,
+        device_id: str | None = None,
+        stats: ConnectionStats | None = None,
+    ) -> DeviceConnection:
+        self.remove(websocket)  # A socket sending init again may change its role
+        connection = DeviceConnection(websocket, name, device_id, stats=stats or ConnectionStats())
+        self._by_socket[websocket] = connection
+        self._by_name.setdefault(name, {})[websocket] = connection
+        if device_id:
+            self._by_id[device_id] = connection
+        return connection
+
+    def remove(self, websocket: WebSocketServerProtocol) -> DeviceConnection | None:
+        connection = self._by_socket.pop(websocket, None)
+        if connection is None:
+            return None
+
+        sockets = self._by_name.get(connection.name, {})
+        sockets.pop(websocket, None)
+        if not sockets:
+            self._by_name.pop(connection.name, None)
+        if connection.device_id and self._by_id.get(connection.device_id) is connection:
+            del self._by_id[connection.device_id]
+        return connection
+
+    def get(self, websocket: WebSocketServerProtocol) -> DeviceConnection | None:
+        return self._by_socket.get(websocket)
+
+    def by_id(self, device_id: str) -> DeviceConnection | None:
+        return self._by_id.get(device_id)
+
+    def sockets(self, name: str) -> list[WebSocketServerProtocol]:
+        return list(self._by_name.get(name, ()))
+
+    def first(self, name: str) -> WebSocketServerProtocol | None:
+        """The socket that connected first under this name."""
+        sockets = self._by_name.get(name)
+        return next(iter(sockets)) if sockets else None
+
+    def is_connected(self, name: str) -> bool:
+        return name in self._by_name
+
+    def _record_sent(self, websocket: WebSocketServerProtocol, payload: str | bytes) -> None:
+        connection = self._by_socket.get(websocket)
+        if connection:
+            # Text frames are counted in bytes as sent, not in characters
+            connection.stats.record_out(len(payload.encode("utf-8")) if isinstance(payload, str) else len(payload))
+
+    def sender(self, websocket: WebSocketServerProtocol):
+        """websocket.send, counted in the connection's stats."""
+
+        async def send(payload: str | bytes) -> None:
+            await websocket.send(payload)
+            self._record_sent(websocket, payload)
+
+        return send
+
+    async def _send(self, websocket: WebSocketServerProtocol, name: str, payload: str | bytes) -> bool:
+        try:
+            await asyncio.wait_for(websocket.send(payload), timeout=self.send_timeout)
+            self._record_sent(websocket, payload)
+            return True
+        except ConnectionClosed:
+            self.logger.warning(f"Failed to send to {name}: connection closed.")
+        except asyncio.TimeoutError:
+            self.logger.warning(f"Failed to send to {name} at {websocket.remote_address}: timed out.")
+        return False
+
+    async def broadcast(self, name: str, payload: str | bytes) -> int:
+        """Sends payload to every socket of the device. Returns how many sends succeeded."""
+
+        sockets = self.sockets(name)
+        if len(sockets) == 1:
+            return int(await self._send(sockets[0], name, payload))
+        results = await asyncio.gather(*(self._send(websocket, name, payload) for websocket in sockets))
+        return sum(results)
@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
 from enum import Enum
 
 
@@ -35,6 +36,7 @@ class Event:
     event_type: EventType
     origin: Origin
     data: dict
+    created_at: float = field(default_factory=time.monotonic, compare=False)  # For the queue wait in EventListener.stats
 
     def __str__(self):
         return f"{self.event_type.name}"
@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from enum import Enum
+from typing import Callable
+
+from ..config import Config
+from .event import Event, EventType
+
+
+class Lane(Enum):
+    CONTROL = "control"  # User and device commands, always small
+    DETECTION = "detection"  # Motion and person triggers
+    BULK = "bulk"  # Images and voice notes
+
+
+@dataclass(frozen=True)
+class LaneSpec:
+    maxsize: int
+    weight: int  # Events taken from this lane per scheduling round while it has any
+    drop_when_full: bool  # Otherwise the producer waits for room
+
+
+LANES = {
+    Lane.CONTROL: LaneSpec(maxsize=Config.CONTROL_LANE_SIZE, weight=8, drop_when_full=False),
+    Lane.DETECTION: LaneSpec(maxsize=Config.DETECTION_LANE_SIZE, weight=4, drop_when_full=False),
+    Lane.BULK: LaneSpec(maxsize=Config.BULK_LANE_SIZE, weight=1, drop_when_full=True),
+}
+
+LANE_BY_EVENT_TYPE = {
+    EventType.MOTION_DETECTED: Lane.DETECTION,
+    EventType.PERSON_DETECTED: Lane.DETECTION,
+    EventType.IMAGE_DATA: Lane.BULK,
+    EventType.AUDIO_DATA: Lane.BULK,
+}  # Everything else is control
+
+
+@dataclass
+class LaneStats:
+    enqueued: int = 0
+    dropped: int = 0
+    max_depth: int = 0
+
+
+class EventBus:
+    """
+    Event queue split into bounded lanes, so a command never waits behind megabytes of frames. Lanes are served by
+    weighted round robin in priority order: each round takes up to weight events from every lane that has any, control
+    first, so bulk data keeps moving but can't delay control events by more than one of its own.
+
+    get() only takes events the caller is ready to handle, so events whose handler is busy keep waiting in their lane,
+    where its bound and drop policy apply. Within a lane an event can be taken ahead of older events of other types.
+    """
+
+    def __init__(self, lanes: dict[Lane, LaneSpec] = LANES):
+        self.logger = logging.getLogger(__name__)
+        self._specs = lanes
+        self._queues: dict[Lane, deque[Event]] = {lane: deque() for lane in lanes}
+        self._credits = {lane: spec.weight for lane, spec in lanes.items()}
+        self._changed = asyncio.Event()  # An event was added, or the caller may be ready for more
+        self._space = asyncio.Event()  # An event was taken, producers waiting for room can retry
+        self.stats = {lane: LaneStats() for lane in lanes}
+
+    @staticmethod
+    def lane_for(event: Event) -> Lane:
+        return LANE_BY_EVENT_TYPE.get(event.event_type, Lane.CONTROL)
+
+    async def put(self, event: Event) -> bool:
+        """Returns False if the event was dropped because its lane was full."""
+
+        lane = self.lane_for(event)
+        spec, queue, stats = self._specs[lane], self._queues[lane], self.stats[lane]
+
+        while len(queue) >= spec.maxsize:
+            if spec.drop_when_full:
+                stats.dropped += 1
+                return False
+            self._space.clear()
+            await self._space.wait()
+
+        queue.append(event)
+        stats.enqueued += 1
+        stats.max_depth = max(stats.max_depth, len(queue))
+        self._changed.set()
+        return True
+
+    def wake(self) -> None:
+        """Makes a waiting get() check again, for when the caller has become ready for events it skipped."""
+
+        self._changed.set()
+
+    @staticmethod
+    def _take_ready(queue: deque[Event], ready: Callable[[Event], bool]) -> Event | None:
+        for index, event in enumerate(queue):
+            if ready(event):
+                del queue[index]
+                return event
+        return None
+
+    def _next_event(self, ready: Callable[[Event], bool]) -> Event | None:
+        for _ in range(2):
+            for lane, queue in self._queues.items():
+                if self._credits[lane] and queue:
+                    event = self._take_ready(queue, ready)
+                    if event is not None:
+                        self._credits[lane] -= 1
+                        self._space.set()
+                        return event
+            # Every lane with ready events has used its share of this round, start the next one
+            self._credits = {lane: spec.weight for lane, spec in self._specs.items()}
+        return None
+
+    async def get(self, ready: Callable[[Event], bool] = lambda event: True) -> Event:
+        while True:
+            self._changed.clear()
+            event = self._next_event(ready)
+            if event is not None:
+                return event
+            await self._changed.wait()
+
+    def depths(self) -> dict[Lane, int]:
+        return {lane: len(queue) for lane, queue in self._queues.items()}
+
+    def qsize(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
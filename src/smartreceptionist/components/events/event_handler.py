@@ -1,17 +1,22 @@
 import asyncio
 import json
 import logging
+import time
+
+import numpy as np
 
 from sinric import SinricPro, SinricProConstants
 
 from ..app_state import AppState, GateState, LightState
-from ..audio_processing.audio_helpers import get_latest_telegram_audio, save_audio_file
+from ..audio_processing.audio_helpers import save_audio_file
 from ..audio_processing.audio_processor import AudioProcessor
 from ..audio_processing.audio_queue import AudioQueue
 from ..config import Config
 from ..events.event import Event, Origin, EventType
+from ..events.event_listener import Policy, Route
 from ..image_processing.image_processor import ImageProcessor
 from ..image_processing.image_queue import ImageQueue
+from ..media_store import MediaStore
 from ..telegram_bot import TelegramBot
 from ..ws_server import WebSocketServer, WSMessage
 
@@ -23,31 +28,69 @@ class EventHandler:
         ws_server: WebSocketServer,
         app_state: AppState,
         image_queue: ImageQueue,
+        image_processor: ImageProcessor,
         sinric_pro_client: SinricPro,
         audio_queue: AudioQueue,
         audio_processor: AudioProcessor,
+        media_store: MediaStore,
     ):
         self.telegram_bot = telegram_bot
         self.ws_server = ws_server
         self.app_state = app_state
         self.image_queue = image_queue
+        self.image_processor = image_processor
         self.sinric_pro_client = sinric_pro_client
         self.audio_queue = audio_queue
         self.audio_processor = audio_processor
+        self.media_store = media_store
         self.logger = logging.getLogger(__name__)
+        self._background_tasks: set[asyncio.Task] = set()
+
+    def routes(self) -> dict[EventType, Route]:
+        """Which handler each event type goes to, and how its events are scheduled."""
+
+        return {
+            EventType.INIT: Route(self.handle_device_init_event, Policy.SERIAL),
+            EventType.CHANGE_STATE: Route(self.handle_ap_state_change_event, Policy.SERIAL),
+            # A motion or person session keeps capturing on its own, repeated triggers during it are dropped
+            EventType.MOTION_DETECTED: Route(self.handle_motion_detected_event, Policy.DROP_WHEN_BUSY),
+            EventType.PERSON_DETECTED: Route(self.handle_person_detected_event, Policy.DROP_WHEN_BUSY),
+            EventType.AUDIO: Route(self.handle_audio_event, Policy.SERIAL),
+            EventType.CAMERA: Route(self.handle_camera_event, Policy.SERIAL),
+            EventType.ACCESS_CONTROL: Route(self.handle_access_control_event, Policy.SERIAL),
+            EventType.RECORDING_SENT: Route(self.handle_recording_sent_event, Policy.SERIAL),
+            EventType.RESET_DEVICE: Route(self.handle_reset_device_event, Policy.SERIAL),
+            EventType.ENROLL_FINGERPRINT: Route(self.handle_enroll_fingerprint, Policy.SERIAL),
+            EventType.FINGERPRINT_ENROLLED: Route(self.handle_fingerprint_enrolled, Policy.SERIAL),
+            EventType.FINGERPRINT_ENROLLMENT_FAILED: Route(self.handle_fingerprint_enrollment_failed, Policy.SERIAL),
+            EventType.MOTION_ENABLE: Route(self.handle_motion_enable_event, Policy.SERIAL),
+            # Always the same server, only the newest request needs to be sent
+            EventType.CHANGE_SERVER: Route(self.handle_change_server_event, Policy.LATEST),
+            # Raw data
+            EventType.IMAGE_DATA: Route(self.handle_image_data, Policy.CONCURRENT, limit=Config.MAX_FRAMES_IN_FLIGHT),
+            EventType.AUDIO_DATA: Route(self.handle_audio_data, Policy.SERIAL),  # One voice note plays at a time
+        }
 
     async def handle_audio_event(self, event: Event):
         action = event.data["action"]
         if event.origin == Origin.TG:
             await self.ws_server.send("esp_s3", WSMessage(event_type=EventType.AUDIO, data={"action": action}))
 
-    async def handle_recording_sent_event(self):
-        pcm_data = await self.audio_queue.get_audio_data()
+    async def handle_device_init_event(self, event: Event):
+        if event.data["device"] == "esp_s3":
+            # New device session, relearn the microphone noise from its next recording
+            self.audio_processor.reset_noise_profile("esp")
 
-        if pcm_data:
-            wav = await self.audio_processor.process_audio(pcm_data, "pcm")
+    async def handle_recording_sent_event(self, event: Event):
+        if self.audio_queue.size:
+            try:
+                wav = await self.audio_queue.get_processed_audio()
+            except Exception as e:
+                self.logger.exception(f"Error processing audio: {e}")
+                await self.audio_queue.cleanup()
+                return
             await self.telegram_bot.send_voice_message(wav)
-            await save_audio_file(wav, "esp")
+            await save_audio_file(self.media_store, wav, "esp")
             await self.audio_queue.cleanup()
             self.logger.info("Audio recording from ESP processed and sent.")
         else:
@@ -107,7 +150,7 @@ class EventHandler:
         if event.data["action"] == "capture_image":
             await self.ws_server.send("esp_cam", WSMessage(event_type=EventType.CAPTURE_IMAGE, data={}))
 
-    async def handle_motion_detected_event(self):
+    async def handle_motion_detected_event(self, event: Event):
         self.app_state.motion_detected = True
         await self.ws_server.send("esp_cam", WSMessage(event_type=EventType.CAPTURE_IMAGE, data={}))
         await asyncio.wait_for(self.image_queue.dequeue_processed_image(), timeout=30)
@@ -145,7 +188,7 @@ class EventHandler:
             await self.ws_server.send("esp_cam", WSMessage(event_type=EventType.CAPTURE_IMAGE, data={}))
             return False
 
-    async def handle_person_detected_event(self):
+    async def handle_person_detected_event(self, event: Event):
         self.app_state.person_detected = True
         await self.ws_server.send("esp_cam", WSMessage(event_type=EventType.CAPTURE_IMAGE, data={}))
         await self.telegram_bot.send_message("👤 Person detected at the gate!")
@@ -173,7 +216,8 @@ class EventHandler:
     async def _handle_person_confirmed_with_face(self):
         self.logger.info("Sending access control prompt and images to Telegram.")
         images = [image for image in await self.image_queue.get_face_detected_images()]
-        [await image.save_to_disk() for image in images]
+        session = self.media_store.new_session()
+        [await image.save_to_disk(self.media_store, session) for image in images]
         await self.telegram_bot.send_images(images=[image.path for image in images])
         await self.telegram_bot.send_access_control_prompt()
         await self.image_queue.cleanup()
@@ -199,7 +243,7 @@ class EventHandler:
         await self.ws_server.send(device, WSMessage(event_type=EventType.RESET_DEVICE, data={}))
         await self.telegram_bot.send_message(f"🔄 Reset command sent to {device.replace('_', '-').upper()}.")
 
-    async def handle_enroll_fingerprint(self):
+    async def handle_enroll_fingerprint(self, event: Event):
         fingerprint_id = self.get_next_fingerprint_id()
         self.logger.info(f"Enrolling fingerprint with ID: {fingerprint_id}")
         await self.ws_server.send("esp_s3", WSMessage(event_type=EventType.ENROLL_FINGERPRINT, data={"id": fingerprint_id}))
@@ -220,24 +264,56 @@ class EventHandler:
 
     # Handling raw data
     async def handle_audio_data(self, event: Event):
-        audio_data = event.data["audio"]
+        # Only Telegram voice notes come through here, ESP audio goes from the socket straight into the AudioQueue
+        if event.origin == Origin.TG:
+            await self.play_telegram_audio(event.data["audio"])
 
-        if event.origin == Origin.ESP:
-            await self.audio_queue.add_audio_chunk(audio_data)
-        elif event.origin == Origin.TG:
-            wav = await self.audio_processor.process_audio(audio_data, "opus")
-            await save_audio_file(wav, "tg")
-            self.logger.info("Audio file from telegram processed and saved.")
+    async def play_telegram_audio(self, audio_data: bytes):
+        """Streams the voice note to the speaker while it is being processed, then archives it in the background."""
 
-            latest_audio_path = await get_latest_telegram_audio()
-            await self.ws_server.start_prefetching(latest_audio_path)
+        start = time.monotonic()
+        blocks = []
+
+        async def processed_blocks():
+            async for block in self.audio_processor.process_audio_blocks(audio_data, "opus"):
+                blocks.append(block)
+                yield block
+
+        pcm = processed_blocks()
+        try:
+            stats = await self.ws_server.stream_audio(pcm)
+            if stats and stats.first_chunk_at is not None:
+                time_to_first_audio = (stats.first_chunk_at - start) * 1000
+                self.logger.info(f"Telegram audio started playing {time_to_first_audio:.0f} ms after it was received.")
+
+            # Finish processing whatever wasn't streamed (speaker not connected or disconnected), so the archive is complete
+            async for _ in pcm:
+                pass
+        except Exception as e:
+            self.logger.exception(f"Error processing Telegram audio: {e}")
+            return
+
+        task = asyncio.create_task(self._archive_audio(b"".join(blocks), "tg"))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+
+    async def _archive_audio(self, pcm: bytes, origin):
+        try:
+            wav = await self.audio_processor.run_dsp(self.audio_processor.encode_wav, np.frombuffer(pcm, dtype="<i2"))
+            file_path = await save_audio_file(self.media_store, wav, origin)
+            self.logger.info(f"Audio from {origin} archived to {file_path}.")
+        except Exception as e:
+            self.logger.error(f"Error archiving audio: {e}")
 
     async def handle_image_data(self, event: Event):
         if self.app_state.motion_detected:
             await self.image_queue.enqueue_image(event.data["image"])
         else:
             # Process the image and send the result to the Telegram bot
-            image = ImageProcessor.apply_processing(event.data["image"])
+            try:
+                image = await self.image_processor.enhance_image(event.data["image"])
+            except Exception:
+                return  # Already logged by the image processor
             await self.telegram_bot.send_image(image)
             self.logger.info("Image processed and sent to Telegram.")
 
@@ -1,81 +1,172 @@
 import asyncio
 import logging
-from typing import TYPE_CHECKING
+import time
+from dataclasses import dataclass
+from enum import Enum
+from typing import TYPE_CHECKING, Awaitable, Callable
 
 from .event import Event, EventType
+from .event_bus import EventBus
 
 if TYPE_CHECKING:
     from .event_handler import EventHandler
 
 
+class Policy(Enum):
+    SERIAL = "serial"  # One at a time, in arrival order, the rest wait in their EventBus lane
+    CONCURRENT = "concurrent"  # Up to Route.limit at once, the rest wait in their EventBus lane
+    LATEST = "latest"  # One at a time, while busy only the newest waiting event is kept
+    DROP_WHEN_BUSY = "drop_when_busy"  # Events arriving while one is being handled are dropped
+
+
+@dataclass
+class Route:
+    handler: Callable[[Event], Awaitable]
+    policy: Policy = Policy.SERIAL
+    limit: int = 1  # Concurrent runs, only used by Policy.CONCURRENT
+
+
+@dataclass
+class EventTypeStats:
+    handled: int = 0
+    dropped: int = 0
+    coalesced: int = 0  # Replaced by a newer event under Policy.LATEST
+    failed: int = 0
+    total_wait: float = 0.0  # Seconds from creation to the handler starting
+    max_wait: float = 0.0
+    total_handle_time: float = 0.0
+    max_handle_time: float = 0.0
+
+    @property
+    def avg_wait(self) -> float:
+        return self.total_wait / self.handled if self.handled else 0.0
+
+    @property
+    def avg_handle_time(self) -> float:
+        return self.total_handle_time / self.handled if self.handled else 0.0
+
+
+@dataclass
+class _RouteState:
+    route: Route
+    running: int = 0
+    latest: Event | None = None  # Policy.LATEST event waiting for the current run to finish
+
+    @property
+    def limit(self) -> int:
+        return self.route.limit if self.route.policy == Policy.CONCURRENT else 1
+
+
 class EventListener:
     def __init__(self):
-        self.queue = asyncio.Queue()
+        self.queue = EventBus()
         self.logger = logging.getLogger(__name__)
         self._handler_tasks = set()  # Store references to handler tasks
+        self._routes: dict[EventType, _RouteState] = {}
+        self.stats: dict[EventType, EventTypeStats] = {}
+
+    def register(self, event_type: EventType, route: Route) -> None:
+        self._routes[event_type] = _RouteState(route)
+        self.stats.setdefault(event_type, EventTypeStats())
 
     async def listen(self, event_handler: "EventHandler"):
+        for event_type, route in event_handler.routes().items():
+            self.register(event_type, route)
         self.logger.info("Event listener started.")
 
         while True:
             try:
-                event = await self.queue.get()
-                task = asyncio.create_task(self._handle_event(event, event_handler))
-                self._handler_tasks.add(task)  # Add the task to the set
-                task.add_done_callback(self._handler_tasks.discard)  # Remove when done
+                event = await self.queue.get(self._ready)
+                self._dispatch(event)
 
             except asyncio.CancelledError:
                 self.logger.info("Event listener stopped.")
+                self._log_stats()
                 await self._cancel_handler_tasks()
                 break
 
-    async def _handle_event(
-        self,
-        event: Event,
-        event_handler: "EventHandler",
-    ):
+    def _ready(self, event: Event) -> bool:
+        """
+        Whether to take the event off the bus now. Events that would have to wait for a run slot stay in their lane
+        instead, so the lane bounds, drop policies and priorities apply to them.
+        """
+
+        state = self._routes.get(event.event_type)
+        if state is None or state.route.policy in (Policy.DROP_WHEN_BUSY, Policy.LATEST):
+            return True  # Handled, dropped or coalesced right away
+        return state.running < state.limit
+
+    def _dispatch(self, event: Event) -> None:
+        """Applies the route's policy: starts the handler, or keeps or drops the event until a run finishes."""
+
+        state = self._routes.get(event.event_type)
+        if state is None:
+            self.logger.warning(f"No handler registered for event: {event}")
+            return
+
+        route, stats = state.route, self.stats[event.event_type]
+
+        if state.running < state.limit:
+            self._start(state, event)
+        elif route.policy == Policy.DROP_WHEN_BUSY:
+            stats.dropped += 1
+            self.logger.info(f"Dropped {event}, the previous one is still being handled.")
+        else:  # Policy.LATEST, _ready() keeps the other policies on the bus until a slot is free
+            if state.latest is not None:
+                stats.coalesced += 1
+            state.latest = event
+
+    def _start(self, state: _RouteState, event: Event) -> None:
         # Do not log if the event is audio_data as it will clutter the logs
         if event.event_type != EventType.AUDIO_DATA:
             self.logger.info(f"Handling event: {event}")
 
-        if event.event_type == EventType.CHANGE_STATE:
-            await asyncio.create_task(event_handler.handle_ap_state_change_event(event))
-        elif event.event_type == EventType.MOTION_DETECTED:
-            await asyncio.create_task(event_handler.handle_motion_detected_event())
-        elif event.event_type == EventType.PERSON_DETECTED:
-            await asyncio.create_task(event_handler.handle_person_detected_event())
-        elif event.event_type == EventType.AUDIO:
-            await asyncio.create_task(event_handler.handle_audio_event(event))
-        elif event.event_type == EventType.CAMERA:
-            await asyncio.create_task(event_handler.handle_camera_event(event))
-        elif event.event_type == EventType.ACCESS_CONTROL:
-            await asyncio.create_task(event_handler.handle_access_control_event(event))
-        elif event.event_type == EventType.RECORDING_SENT:
-            await asyncio.create_task(event_handler.handle_recording_sent_event())
-        elif event.event_type == EventType.RESET_DEVICE:
-            await asyncio.create_task(event_handler.handle_reset_device_event(event))
-        elif event.event_type == EventType.ENROLL_FINGERPRINT:
-            await asyncio.create_task(event_handler.handle_enroll_fingerprint())
-        elif event.event_type == EventType.FINGERPRINT_ENROLLED:
-            await asyncio.create_task(event_handler.handle_fingerprint_enrolled(event))
-        elif event.event_type == EventType.FINGERPRINT_ENROLLMENT_FAILED:
-            await asyncio.create_task(event_handler.handle_fingerprint_enrollment_failed(event))
-        elif event.event_type == EventType.MOTION_ENABLE:
-            await asyncio.create_task(event_handler.handle_motion_enable_event(event))
-        elif event.event_type == EventType.CHANGE_SERVER:
-            await asyncio.create_task(event_handler.handle_change_server_event(event))
-
-        # Handling raw data
-        elif event.event_type == EventType.IMAGE_DATA:
-            await asyncio.create_task(event_handler.handle_image_data(event))
-        elif event.event_type == EventType.AUDIO_DATA:
-            await asyncio.create_task(event_handler.handle_audio_data(event))
-
-        # Mark the task as done
-        self.queue.task_done()
+        started = time.monotonic()
+        wait = started - event.created_at
+        stats = self.stats[event.event_type]
+        stats.total_wait += wait
+        stats.max_wait = max(stats.max_wait, wait)
+
+        state.running += 1
+        task = asyncio.create_task(state.route.handler(event))
+        self._handler_tasks.add(task)  # Add the task to the set
+        task.add_done_callback(lambda task: self._on_handler_done(task, state, event, started))
+
+    def _on_handler_done(self, task: asyncio.Task, state: _RouteState, event: Event, started: float) -> None:
+        self._handler_tasks.discard(task)
+        state.running -= 1
+
+        stats = self.stats[event.event_type]
+        handle_time = time.monotonic() - started
+        stats.handled += 1
+        stats.total_handle_time += handle_time
+        stats.max_handle_time = max(stats.max_handle_time, handle_time)
+
+        if not task.cancelled() and task.exception():
+            stats.failed += 1
+            self.logger.error(f"Error handling event {event}: {task.exception()}", exc_info=task.exception())
+
+        if state.latest is not None and not task.cancelled():
+            event, state.latest = state.latest, None
+            self._start(state, event)
+        # A run slot is free, events of this type waiting on the bus can be taken now
+        self.queue.wake()
+
+    def _log_stats(self) -> None:
+        for lane, stats in self.queue.stats.items():
+            self.logger.info(
+                f"{lane.value} lane: {stats.enqueued} enqueued, {stats.dropped} dropped, max depth {stats.max_depth}"
+            )
+        for event_type, stats in self.stats.items():
+            if stats.handled or stats.dropped:
+                self.logger.info(
+                    f"{event_type.name}: {stats.handled} handled ({stats.failed} failed), {stats.dropped} dropped, "
+                    f"{stats.coalesced} coalesced, wait avg {stats.avg_wait * 1000:.1f} / max {stats.max_wait * 1000:.1f} ms, "
+                    f"handler avg {stats.avg_handle_time * 1000:.1f} / max {stats.max_handle_time * 1000:.1f} ms"
+                )
 
     async def _cancel_handler_tasks(self):
-        for task in self._handler_tasks:
+        for task in list(self._handler_tasks):
             if not task.done():
                 task.cancel()
                 try:
@@ -84,7 +175,5 @@ class EventListener:
                     pass
 
     async def enqueue_event(self, event: Event):
-        try:
-            await self.queue.put(event)
-        except asyncio.QueueFull:
-            self.logger.error("Event queue is full. Event dropped.")
+        if not await self.queue.put(event):
+            self.logger.error(f"Event queue lane {self.queue.lane_for(event).value} is full. Event dropped: {event}")
@@ -0,0 +1,169 @@
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+_local = threading.local()
+
+MIN_REGION_SIZE = 16  # Pixels, smaller regions are left unenhanced
+REGION_GRID = 128  # Pixels, region sizes are rounded up to a multiple of this so their buffers can be reused
+
+
+class _FrameBuffers:
+    def __init__(self, shape: tuple[int, int]):
+        self.color = np.empty((*shape, 3), dtype=np.uint8)  # LAB, then HSV
+        self.bgr = np.empty((*shape, 3), dtype=np.uint8)
+        self.denoised = np.empty((*shape, 3), dtype=np.uint8)
+        self.blurred = np.empty((*shape, 3), dtype=np.uint8)
+        self.output = np.empty((*shape, 3), dtype=np.uint8)
+        self.channel = np.empty(shape, dtype=np.uint8)
+        self.enhanced_channel = np.empty(shape, dtype=np.uint8)
+
+
+class EnhancementPipeline:
+    """
+    Same result as ImageProcessor.preprocess_image followed by postprocess_image, but working in buffers that are
+    allocated once per frame shape and reused. The returned array is one of those buffers, so it is only valid until the
+    next call with the same shape. Not thread-safe, use get_enhancement_pipeline() to get one per thread.
+    """
+
+    def __init__(
+        self,
+        clahe_clip=2.0,
+        clahe_grid=(6, 6),
+        blur_kernel=(3, 3),
+        sharpen_amount=0.5,
+        saturation_factor=1.1,
+        max_cached_shapes=4,
+    ):
+        self.clahe = cv2.createCLAHE(clipLimit=clahe_clip, tileGridSize=clahe_grid)
+        self.blur_kernel = blur_kernel
+        self.sharpen_amount = sharpen_amount
+        self.saturation_factor = saturation_factor
+        self.max_cached_shapes = max_cached_shapes
+        self._buffers: OrderedDict[tuple[int, int], _FrameBuffers] = OrderedDict()
+
+    def _get_buffers(self, shape: tuple[int, int]) -> _FrameBuffers:
+        buffers = self._buffers.get(shape)
+        if buffers is None:
+            buffers = self._buffers[shape] = _FrameBuffers(shape)
+            if len(self._buffers) > self.max_cached_shapes:
+                self._buffers.popitem(last=False)
+        else:
+            self._buffers.move_to_end(shape)
+        return buffers
+
+    def enhance(self, image: np.ndarray, boxes=()) -> np.ndarray:
+        """Enhances a BGR image. Boxes (x1, y1, x2, y2) are drawn between the denoise and sharpen steps."""
+
+        b = self._get_buffers(image.shape[:2])
+
+        # CLAHE on the L channel, in place inside the LAB buffer
+        cv2.cvtColor(image, cv2.COLOR_BGR2LAB, dst=b.color)
+        cv2.extractChannel(b.color, 0, dst=b.channel)
+        self.clahe.apply(b.channel, dst=b.enhanced_channel)
+        cv2.insertChannel(b.enhanced_channel, b.color, 0)
+        cv2.cvtColor(b.color, cv2.COLOR_LAB2BGR, dst=b.bgr)
+
+        cv2.GaussianBlur(b.bgr, self.blur_kernel, 0, dst=b.denoised)
+
+        for x1, y1, x2, y2 in boxes:
+            cv2.rectangle(b.denoised, (x1, y1), (x2, y2), (0, 255, 0), 1)
+
+        # Unsharp mask
+        cv2.GaussianBlur(b.denoised, (0, 0), 2.0, dst=b.blurred)
+        cv2.addWeighted(b.denoised, 1 + self.sharpen_amount, b.blurred, -self.sharpen_amount, 0, dst=b.bgr)
+
+        # Saturation boost, computed in float and saturated to uint8 by convertScaleAbs, so it can't wrap around
+        cv2.cvtColor(b.bgr, cv2.COLOR_BGR2HSV, dst=b.color)
+        cv2.extractChannel(b.color, 1, dst=b.channel)
+        cv2.convertScaleAbs(b.channel, dst=b.channel, alpha=self.saturation_factor)
+        cv2.insertChannel(b.channel, b.color, 1)
+        cv2.cvtColor(b.color, cv2.COLOR_HSV2BGR, dst=b.output)
+
+        return b.output
+
+    def enhance_regions(self, image: np.ndarray, boxes, margin: float) -> np.ndarray:
+        """
+        Enhances only the areas around the boxes, each grown by margin times its size, and writes them back into image.
+        Overlapping areas are merged first so no pixel gets enhanced twice, and sizes are rounded up to REGION_GRID so
+        a few buffer shapes serve every frame. CLAHE only sees the region, so the result differs from enhancing the whole
+        frame.
+        """
+
+        height, width = image.shape[:2]
+        boxes = [(max(0, x1), max(0, y1), min(width, x2), min(height, y2)) for x1, y1, x2, y2 in boxes]
+        regions = []
+        for x1, y1, x2, y2 in boxes:
+            margin_x, margin_y = int((x2 - x1) * margin), int((y2 - y1) * margin)
+            regions.append(
+                [max(0, x1 - margin_x), max(0, y1 - margin_y), min(width, x2 + margin_x), min(height, y2 + margin_y)]
+            )
+
+        for rx1, ry1, rx2, ry2 in _snap_regions(regions, width, height):
+            region_boxes = [
+                (x1 - rx1, y1 - ry1, x2 - rx1, y2 - ry1)
+                for x1, y1, x2, y2 in boxes
+                if rx1 <= x1 and ry1 <= y1 and x2 <= rx2 and y2 <= ry2
+            ]
+            if rx2 - rx1 < MIN_REGION_SIZE or ry2 - ry1 < MIN_REGION_SIZE:
+                # Too small for CLAHE tiles, just mark the face
+                for x1, y1, x2, y2 in region_boxes:
+                    cv2.rectangle(image, (x1 + rx1, y1 + ry1), (x2 + rx1, y2 + ry1), (0, 255, 0), 1)
+                continue
+
+            region = np.ascontiguousarray(image[ry1:ry2, rx1:rx2])
+            image[ry1:ry2, rx1:rx2] = self.enhance(region, region_boxes)
+
+        return image
+
+
+def _merge_regions(regions: list[list[int]]) -> list[list[int]]:
+    merged = []
+    for region in regions:
+        # Keep absorbing overlapping regions until the current one doesn't touch any of the merged ones
+        overlapping = True
+        while overlapping:
+            overlapping = False
+            for other in merged:
+                if region[0] < other[2] and other[0] < region[2] and region[1] < other[3] and other[1] < region[3]:
+                    merged.remove(other)
+                    region = [
+                        min(region[0], other[0]),
+                        min(region[1], other[1]),
+                        max(region[2], other[2]),
+                        max(region[3], other[3]),
+                    ]
+                    overlapping = True
+                    break
+        merged.append(region)
+    return merged
+
+
+def _snap_to_grid(start: int, end: int, limit: int) -> tuple[int, int]:
+    size = min(limit, -(-(end - start) // REGION_GRID) * REGION_GRID)
+    start = max(0, min(start, limit - size))  # Grow away from the frame edge
+    return start, start + size
+
+
+def _snap_regions(regions: list[list[int]], width: int, height: int) -> list[list[int]]:
+    """Merges the regions and rounds them up to the grid, again until grown regions no longer overlap."""
+
+    merged = _merge_regions(regions)
+    while True:
+        snapped = []
+        for x1, y1, x2, y2 in merged:
+            x1, x2 = _snap_to_grid(x1, x2, width)
+            y1, y2 = _snap_to_grid(y1, y2, height)
+            snapped.append([x1, y1, x2, y2])
+        merged = _merge_regions(snapped)
+        if len(merged) == len(snapped):
+            return merged
+
+
+def get_enhancement_pipeline() -> EnhancementPipeline:
+    pipeline = getattr(_local, "pipeline", None)
+    if pipeline is None:
+        pipeline = _local.pipeline = EnhancementPipeline()
+    return pipeline
@@ -0,0 +1,49 @@
+from collections import deque
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+
+class FrameHandle(NamedTuple):
+    slot: int
+    offset: int
+    length: int
+
+
+class FrameRing:
+    """Fixed-size frame slots in one shared memory block, written once by the server and read in place by the workers."""
+
+    def __init__(self, slots: int, slot_size: int):
+        self.slot_size = slot_size
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        self._free_slots = deque(range(slots))
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def write(self, data: bytes | memoryview) -> FrameHandle | None:
+        """Copies the frame into a free slot. Returns None if the ring is full or the frame doesn't fit in a slot."""
+
+        length = len(data)
+        if length > self.slot_size or not self._free_slots:
+            return None
+
+        slot = self._free_slots.popleft()
+        offset = slot * self.slot_size
+        self._shm.buf[offset : offset + length] = data
+        return FrameHandle(slot, offset, length)
+
+    def read(self, offset: int, length: int) -> bytes:
+        return bytes(self._shm.buf[offset : offset + length])
+
+    def release(self, handle: FrameHandle) -> None:
+        self._free_slots.append(handle.slot)
+
+    def close(self) -> None:
+        self._shm.close()
+        self._shm.unlink()
+
+
+def attach_frame_ring(name: str) -> shared_memory.SharedMemory:
+    # Pool workers share the server's resource tracker, so attaching here doesn't make a worker's exit unlink the block
+    return shared_memory.SharedMemory(name=name)
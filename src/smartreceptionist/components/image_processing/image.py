@@ -1,28 +1,32 @@
-import asyncio
 import logging
-import time
 from dataclasses import dataclass, field
 from pathlib import Path
 
+from ..media_store import MediaStore, media_name, media_path, new_media_id
+
 
 @dataclass
 class Image:
     image_data: bytes  # Raw image data
     faces_detected: bool = False
     image_name: str = field(default=None)
+    timings: dict[str, float] = field(default_factory=dict)  # Seconds spent per stage, e.g. "model_load", "inference"
     logger: logging.Logger = field(init=False)
+    media_id: int = field(init=False)
     path: Path = field(init=False)
 
     def __post_init__(self):
         self.logger = logging.getLogger(__name__)
-        self.image_name = str(time.strftime("%Y%m%d-%H%M%S"))
-        self.path = Path("media/images") / f"{self.image_name}.jpg"
+        # Unique even for frames captured within the same second
+        self.media_id = new_media_id()
+        self.image_name = media_name(self.media_id)
+        self.path = media_path("image", "esp", self.media_id, ".jpg")
 
-    async def save_to_disk(self) -> None:
+    async def save_to_disk(self, media_store: MediaStore, session: str | None = None) -> None:
         try:
-            loop = asyncio.get_running_loop()
-            await loop.run_in_executor(None, lambda: self.path.write_bytes(self.image_data))
+            entry = await media_store.save(self.image_data, "image", "esp", ".jpg", session=session, media_id=self.media_id)
+            self.path = entry.path
 
             self.logger.info(f"Image saved to {self.path}")
-        except FileNotFoundError as e:
+        except OSError as e:
             self.logger.error(f"Error saving image: {e}")
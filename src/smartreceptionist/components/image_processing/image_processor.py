@@ -1,65 +1,278 @@
 import asyncio
 import concurrent.futures
 import logging
+import os
+import time
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import NamedTuple
 
 import cv2
 import numpy as np
 from ultralytics import YOLO
 
+from ..config import Config
+from .enhancement import get_enhancement_pipeline
+from .frame_ring import FrameHandle, FrameRing, attach_frame_ring
 from .image import Image
 
+# YOLO model can't be pickled, so each pool worker loads its own copy once in _init_worker and keeps it here.
+_model: YOLO | None = None
+_model_load_time = 0.0
+_frame_ring: shared_memory.SharedMemory | None = None
+_frame_slot_size = 0
+
+
+class DetectionResult(NamedTuple):
+    """What a worker sends back for a frame, instead of a pickled Image."""
+
+    faces_detected: bool
+    offset: int  # Where the encoded result was written back into the frame's slot, -1 if it is returned inline
+    length: int
+    data: bytes | None  # Only set when the frame wasn't in the ring or the result didn't fit in its slot
+    inference_time: float
+    model_load_time: float
+    batch_size: int
+
+
+def _init_worker(model_path: str, frame_ring_name: str, frame_slot_size: int) -> None:
+    global _model, _model_load_time, _frame_ring, _frame_slot_size
+
+    _frame_ring = attach_frame_ring(frame_ring_name)
+    _frame_slot_size = frame_slot_size
+
+    start = time.perf_counter()
+    _model = YOLO(model_path)
+    # Run a dummy inference so the first real frame doesn't pay for the graph warm-up
+    _model(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+    _model_load_time = time.perf_counter() - start
+
+    logging.getLogger(__name__).info(f"Face detection model loaded in worker {os.getpid()} in {_model_load_time:.2f}s")
+
+
+@dataclass
+class DetectionMetrics:
+    model_load_time: float = 0.0  # Slowest one-off model load + warm-up seen across workers
+    ring_fallbacks: int = 0  # Frames pickled into the pool because the frame ring was full or they didn't fit a slot
+    frames_processed: int = 0
+    total_inference_time: float = 0.0
+    last_inference_time: float = 0.0
+
+    @property
+    def avg_inference_time(self) -> float:
+        return self.total_inference_time / self.frames_processed if self.frames_processed else 0.0
+
+    def record(self, image: Image) -> None:
+        self.model_load_time = max(self.model_load_time, image.timings.get("model_load", 0.0))
+        self.last_inference_time = image.timings.get("inference", 0.0)
+        self.total_inference_time += self.last_inference_time
+        self.frames_processed += 1
+
 
 class ImageProcessor:
-    def __init__(self):
+    def __init__(
+        self,
+        model_path: str = Config.FACE_MODEL_PATH,
+        max_workers: int = Config.DETECTION_WORKERS,
+        max_enhance_jobs: int = Config.MAX_ENHANCE_JOBS,
+        frame_slots: int = Config.MAX_FRAMES_IN_FLIGHT,
+        frame_slot_size: int = Config.FRAME_SLOT_SIZE,
+    ):
         self.logger = logging.getLogger(__name__)
-        self.process_pool = concurrent.futures.ProcessPoolExecutor(max_workers=1)
+        self.metrics = DetectionMetrics()
+
+        # Frames are copied once into shared memory and workers only receive slot offsets. Frames that don't fit
+        # (ring full or oversized) fall back to being pickled into the pool.
+        self.frame_ring = FrameRing(slots=frame_slots, slot_size=frame_slot_size)
+        self.process_pool = concurrent.futures.ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker,
+            initargs=(model_path, self.frame_ring.name, frame_slot_size),
+        )
+
+        # Enhancement for on-demand captures runs in threads (OpenCV releases the GIL), capped to a few concurrent jobs
+        self.enhance_pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_enhance_jobs, thread_name_prefix="enhance")
+        self._enhance_slots = asyncio.Semaphore(max_enhance_jobs)
+
+    async def process_images(self, batch: list[bytes | memoryview]) -> list[Image | None]:
+        """Runs face detection on a batch of frames in a single model call. Undecodable frames come back as None."""
+
+        handles = [self.frame_ring.write(image_data) for image_data in batch]
+        fallbacks = handles.count(None)
+        if fallbacks:
+            self.metrics.ring_fallbacks += fallbacks
+            self.logger.warning(
+                f"{fallbacks} frame(s) didn't get a frame ring slot and are copied into the pool "
+                f"({self.metrics.ring_fallbacks} so far)"
+            )
+        frames = [handle if handle is not None else bytes(image_data) for handle, image_data in zip(handles, batch)]
 
-    async def process_image(self, image_data: bytes) -> Image:
         loop = asyncio.get_running_loop()
+        future = self.process_pool.submit(self._process_batch_sync, frames)
         try:
-            processed_image = await loop.run_in_executor(self.process_pool, self._process_image_sync, image_data)
-            return processed_image
+            results = await asyncio.wrap_future(future)
+            processed_images = [self._to_image(result) if result is not None else None for result in results]
+        except asyncio.CancelledError:
+            # A worker may still be reading the frames or writing results into their slots, so the slots are only
+            # reused once it is done with them
+            future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release_frames, handles))
+            raise
         except Exception as e:
-            self.logger.error(f"Error processing image: {e}")
+            self.logger.error(f"Error processing image batch: {e}")
+            self._release_frames(handles)
             raise
+        self._release_frames(handles)
+
+        for processed_image in processed_images:
+            if processed_image is not None:
+                self.metrics.record(processed_image)
+
+        self.logger.info(
+            f"Face detection on {len(batch)} frame(s) took {self.metrics.last_inference_time * 1000:.0f} ms per frame "
+            f"(avg {self.metrics.avg_inference_time * 1000:.0f} ms, one-off model load {self.metrics.model_load_time:.2f}s)"
+        )
+        return processed_images
+
+    def _release_frames(self, handles: list[FrameHandle | None]) -> None:
+        for handle in handles:
+            if handle is not None:
+                self.frame_ring.release(handle)
+
+    def _to_image(self, result: DetectionResult) -> Image:
+        image_data = result.data if result.data is not None else self.frame_ring.read(result.offset, result.length)
+        return Image(
+            image_data=image_data,
+            faces_detected=result.faces_detected,
+            timings={
+                "model_load": result.model_load_time,
+                "inference": result.inference_time,
+                "batch_size": result.batch_size,
+            },
+        )
+
+    def close(self) -> None:
+        self.process_pool.shutdown(cancel_futures=True)
+        self.enhance_pool.shutdown(cancel_futures=True)
+        self.frame_ring.close()
 
     @staticmethod
-    def _process_image_sync(image_data: bytes) -> Image:
-        # YOLO model can't be pickled, so it needs to be initialized within the process.
-        model = YOLO("yolov8n-face.pt")
+    def _read_frame(frame: FrameHandle | bytes) -> np.ndarray:
+        if isinstance(frame, FrameHandle):
+            # Decode straight out of shared memory, no copy
+            return np.frombuffer(_frame_ring.buf, dtype=np.uint8, count=frame.length, offset=frame.offset)
+        return np.frombuffer(frame, dtype=np.uint8)
 
-        image_array = np.frombuffer(image_data, dtype=np.uint8)
-        image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+    @staticmethod
+    def _write_result(frame: FrameHandle | bytes, buffer: np.ndarray) -> tuple[int, int, bytes | None]:
+        # The input frame is already decoded, so its slot can hold the encoded result
+        if isinstance(frame, FrameHandle) and buffer.size <= _frame_slot_size:
+            _frame_ring.buf[frame.offset : frame.offset + buffer.size] = buffer
+            return frame.offset, buffer.size, None
+        return -1, buffer.size, buffer.tobytes()
+
+    @staticmethod
+    def _detection_input(image: np.ndarray) -> tuple[np.ndarray, float]:
+        """Returns the RGB frame to run detection on, downscaled to Config.DETECTION_INPUT_SIZE, and its scale factor."""
+
+        scale = 1.0
+        if Config.DETECTION_INPUT_SIZE:
+            scale = min(1.0, Config.DETECTION_INPUT_SIZE / max(image.shape[:2]))
+        if scale < 1.0:
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), scale
+
+    @staticmethod
+    def _process_batch_sync(batch: list[FrameHandle | bytes]) -> list[DetectionResult | None]:
+        if _model is None:
+            raise RuntimeError("Face detection model is not loaded in this worker")
+
+        images = [cv2.imdecode(ImageProcessor._read_frame(frame), cv2.IMREAD_COLOR) for frame in batch]
+        decoded = [image for image in images if image is not None]
+        if not decoded:
+            return [None] * len(batch)
+
+        detection_inputs = [ImageProcessor._detection_input(image) for image in decoded]
+        images_rgb = [image_rgb for image_rgb, _ in detection_inputs]
+        scales = iter([scale for _, scale in detection_inputs])
+        start = time.perf_counter()
+        results = iter(_model(images_rgb))
+        # Amortized over the batch, which is what each frame effectively costs
+        inference_time = (time.perf_counter() - start) / len(decoded)
+
+        detection_results = []
+        for frame, image in zip(batch, images):
+            if image is None:
+                detection_results.append(None)
+                continue
+
+            result, scale = next(results), next(scales)
+            faces_detected = len(result.boxes) > 0
+
+            if faces_detected:
+                # Map the boxes from the downscaled detection input back to the full resolution frame
+                boxes = [tuple(int(coordinate / scale) for coordinate in xyxy) for xyxy in result.boxes.xyxy.tolist()]
+                if Config.FACE_REGION_MARGIN is None:
+                    final_image = get_enhancement_pipeline().enhance(image, boxes)
+                else:
+                    final_image = get_enhancement_pipeline().enhance_regions(image, boxes, Config.FACE_REGION_MARGIN)
+            else:
+                final_image = image
+
+            _, buffer = cv2.imencode(".jpg", final_image)
+            offset, length, data = ImageProcessor._write_result(frame, buffer)
+            detection_results.append(
+                DetectionResult(faces_detected, offset, length, data, inference_time, _model_load_time, len(decoded))
+            )
+
+        return detection_results
+
+    async def make_thumbnails(self, batch: list[bytes | memoryview]) -> list[np.ndarray | None]:
+        """Runs make_thumbnail over a batch off the event loop."""
+
+        if not batch:
+            return []
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, lambda: [self.make_thumbnail(image_data) for image_data in batch])
+
+    @staticmethod
+    def make_thumbnail(image_data: bytes | memoryview, size: int = Config.FRAME_DIFF_THUMBNAIL_SIZE) -> np.ndarray | None:
+        """Tiny grayscale version of a frame for cheap similarity checks. JPEG is decoded at 1/8 scale to keep it fast."""
+
+        image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
         if image is None:
-            raise ValueError("Invalid image data")
+            return None
+        return cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA).astype(np.int16)
 
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        results = model(image_rgb)
+    @staticmethod
+    def thumbnail_difference(first: np.ndarray, second: np.ndarray) -> float:
+        """Mean absolute difference between two thumbnails, in grey levels (0-255)."""
 
-        faces_detected = len(results[0].boxes) > 0
+        return float(np.mean(np.abs(first - second)))
 
-        if faces_detected:
-            preprocessed = ImageProcessor.preprocess_image(image)
-            for result in results:
-                boxes = result.boxes
-                for box in boxes:
-                    x1, y1, x2, y2 = map(int, box.xyxy.tolist()[0])
-                    cv2.rectangle(preprocessed, (x1, y1), (x2, y2), (0, 255, 0), 1)
-            final_image = ImageProcessor.postprocess_image(preprocessed)
-        else:
-            final_image = image
+    async def enhance_image(self, image_data: bytes | memoryview) -> bytes:
+        """Runs apply_processing off the event loop and returns the enhanced JPEG."""
 
-        _, buffer = cv2.imencode(".jpg", final_image)
-        processed_image = Image(image_data=buffer.tobytes(), faces_detected=faces_detected)
-        return processed_image
+        loop = asyncio.get_running_loop()
+        async with self._enhance_slots:
+            start = time.perf_counter()
+            try:
+                enhanced = await loop.run_in_executor(self.enhance_pool, self.apply_processing, image_data)
+            except Exception as e:
+                self.logger.error(f"Error enhancing image: {e}")
+                raise
+            processing_time = time.perf_counter() - start
+
+        self.logger.info(f"Image enhanced in {processing_time * 1000:.0f} ms.")
+        return enhanced
 
     @staticmethod
     def apply_processing(image_data) -> bytes:
         image_array = np.frombuffer(image_data, dtype=np.uint8)
         image = cv2.imdecode(image_array, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Invalid image data")
 
-        preprocessed = ImageProcessor.preprocess_image(image)
-        final_image = ImageProcessor.postprocess_image(preprocessed)
+        final_image = get_enhancement_pipeline().enhance(image)
 
         _, buffer = cv2.imencode(".jpg", final_image)
 
@@ -94,8 +307,8 @@ class ImageProcessor:
 
         # Increase saturation
         hsv = cv2.cvtColor(sharpened, cv2.COLOR_BGR2HSV)
-        hsv[:, :, 1] = hsv[:, :, 1] * saturation_factor
-        hsv[:, :, 1] = np.clip(hsv[:, :, 1], 0, 255)
+        # Clip before casting back to uint8, otherwise values above 255 wrap around
+        hsv[:, :, 1] = np.clip(hsv[:, :, 1] * saturation_factor, 0, 255)
         final = cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)
 
         return final
@@ -1,55 +1,276 @@
 import asyncio
 import logging
+import time
+from dataclasses import dataclass
 
+from ..config import Config
 from .image import Image
 from .image_processor import ImageProcessor
 
 
+@dataclass
+class ImageQueueStats:
+    frames_enqueued: int = 0
+    frames_dropped: int = 0  # Rejected because the unprocessed queue was full
+    frames_processed: int = 0
+    frames_failed: int = 0
+    frames_discarded: int = 0  # Finished after their motion session was cleaned up
+    frames_checked: int = 0  # Went through the frame difference pre-filter
+    frames_skipped: int = 0  # Looked like the previous analysed frame, so detection was skipped
+    reuse_hits: int = 0  # Skipped frames that got the earlier detection result
+    total_latency: float = 0.0  # Enqueue -> result available, in seconds
+    max_latency: float = 0.0
+
+    @property
+    def avg_latency(self) -> float:
+        return self.total_latency / self.frames_processed if self.frames_processed else 0.0
+
+    @property
+    def skip_rate(self) -> float:
+        return self.frames_skipped / self.frames_checked if self.frames_checked else 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.reuse_hits / self.frames_skipped if self.frames_skipped else 0.0
+
+    def record_latency(self, latency: float) -> None:
+        self.frames_processed += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+
 class ImageQueue:
     def __init__(
         self,
         image_processor: ImageProcessor,
         max_unprocessed_queue_size: int = 20,
         max_processed_queue_size: int = 10,
+        max_frames_in_flight: int = Config.MAX_FRAMES_IN_FLIGHT,
+        batch_size: int = Config.DETECTION_BATCH_SIZE,
+        batch_wait_ms: int = Config.DETECTION_BATCH_WAIT_MS,
+        frame_diff_threshold: float = Config.FRAME_DIFF_THRESHOLD,
     ):
         self.image_processor = image_processor
         self._unprocessed_image_queue = asyncio.Queue(maxsize=max_unprocessed_queue_size)
         self._processed_image_queue = asyncio.Queue(maxsize=max_processed_queue_size)
         self._faces_detected_images = asyncio.Queue(maxsize=max_processed_queue_size)
         self.num_of_face_detected_images = 0
+        self.stats = ImageQueueStats()
         self.logger = logging.getLogger(__name__)
+
+        # Frames are submitted to the pool concurrently (bounded by the semaphore), but their futures are queued in
+        # submission order, so results are always delivered in the order the frames arrived.
+        self._in_flight = asyncio.Semaphore(max_frames_in_flight)
+        self._frames_in_flight = 0
+        self._pending_results = asyncio.Queue()
+
+        # Frames arriving close together are grouped into one batched model call. A batch can never hold more
+        # frames than are allowed in flight, otherwise acquiring its slots would never complete.
+        self._batch_size = max(1, min(batch_size, max_frames_in_flight))
+        self._batch_wait = batch_wait_ms / 1000
+
+        # Frame difference pre-filter state, reset with every motion session
+        self._frame_diff_threshold = frame_diff_threshold
+        self._last_thumbnail = None
+        self._last_analysed_image: Image | None = None
+
+        # Bumped on cleanup so that frames belonging to a finished motion session are discarded
+        self._session = 0
+
         self._consumer_task = None
+        self._collector_task = None
+
+    @property
+    def queue_depth(self) -> int:
+        return self._unprocessed_image_queue.qsize()
+
+    @property
+    def frames_in_flight(self) -> int:
+        return self._frames_in_flight
+
+    def get_stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "frames_in_flight": self.frames_in_flight,
+            "frames_enqueued": self.stats.frames_enqueued,
+            "frames_dropped": self.stats.frames_dropped,
+            "frames_processed": self.stats.frames_processed,
+            "frames_failed": self.stats.frames_failed,
+            "frames_discarded": self.stats.frames_discarded,
+            "frames_skipped": self.stats.frames_skipped,
+            "skip_rate": self.stats.skip_rate,
+            "hit_rate": self.stats.hit_rate,
+            "avg_latency_ms": self.stats.avg_latency * 1000,
+            "max_latency_ms": self.stats.max_latency * 1000,
+        }
 
-    async def enqueue_image(self, image_data: str):
+    async def enqueue_image(self, image_data: bytes | memoryview):
         try:
-            await self._unprocessed_image_queue.put(image_data)
+            self._unprocessed_image_queue.put_nowait((self._session, time.monotonic(), image_data))
+            self.stats.frames_enqueued += 1
         except asyncio.QueueFull:
+            self.stats.frames_dropped += 1
             self.logger.error("Unprocessed image queue is full. Image dropped.")
 
         if self._consumer_task is None or self._consumer_task.done():
             self._consumer_task = asyncio.create_task(self._process_images())
+        if self._collector_task is None or self._collector_task.done():
+            self._collector_task = asyncio.create_task(self._collect_results())
+
+    async def _next_batch(self) -> list[tuple[int, float, bytes | memoryview]]:
+        # Wait for the first frame, then keep collecting until the batch is full or the batching window closes
+        batch = [await self._unprocessed_image_queue.get()]
+        self._unprocessed_image_queue.task_done()
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self._batch_wait
+        while len(batch) < self._batch_size:
+            try:
+                if self._unprocessed_image_queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    item = await asyncio.wait_for(self._unprocessed_image_queue.get(), timeout)
+                else:
+                    item = self._unprocessed_image_queue.get_nowait()
+            except asyncio.TimeoutError:
+                break
+            self._unprocessed_image_queue.task_done()
+            batch.append(item)
+
+        return batch
+
+    def _is_repeat(self, thumbnail) -> bool:
+        if thumbnail is None or self._last_thumbnail is None or not self._frame_diff_threshold:
+            return False
+        return ImageProcessor.thumbnail_difference(thumbnail, self._last_thumbnail) <= self._frame_diff_threshold
 
     async def _process_images(self) -> None:
         while True:
             try:
-                image_data = await self._unprocessed_image_queue.get()
-                self._unprocessed_image_queue.task_done()  # Mark the task as done in the unprocessed queue
+                batch = await self._next_batch()
             except asyncio.CancelledError:
                 self.logger.info("Image processing task cancelled.")
                 break
 
+            session = self._session
+            self.stats.frames_discarded += sum(1 for item in batch if item[0] != session)
+
+            items = [item for item in batch if item[0] == session]
             try:
-                image = await self.image_processor.process_image(image_data)
-                await self._processed_image_queue.put(image)
+                thumbnails = await self.image_processor.make_thumbnails([image_data for _, _, image_data in items])
+            except asyncio.CancelledError:
+                self.logger.info("Image processing task cancelled.")
+                break
+            if session != self._session:
+                # Cleaned up meanwhile, don't let these frames seed the new session's pre-filter
+                self.stats.frames_discarded += len(items)
+                continue
+
+            # Frames that look like the previous analysed frame skip detection and reuse its verdict, keeping their own
+            # image data. A reused verdict points at an earlier frame in this batch, or at None for the last analysed
+            # frame of an earlier batch. Analysed frames have no repeat data.
+            frames, sources = [], []
+            last_analysed = None
+            for (_, enqueued_at, image_data), thumbnail in zip(items, thumbnails):
+                self.stats.frames_checked += 1
+                if self._is_repeat(thumbnail):
+                    self.stats.frames_skipped += 1
+                    sources.append((enqueued_at, last_analysed, image_data))
+                    continue
+
+                if thumbnail is not None:
+                    self._last_thumbnail = thumbnail
+                last_analysed = len(frames)
+                sources.append((enqueued_at, last_analysed, None))
+                frames.append(image_data)
+
+            if not sources:
+                continue
+
+            try:
+                for _ in frames:
+                    await self._in_flight.acquire()
+            except asyncio.CancelledError:
+                self.logger.info("Image processing task cancelled.")
+                break
+
+            future = None
+            if frames:
+                self._frames_in_flight += len(frames)
+                future = asyncio.ensure_future(self.image_processor.process_images(frames))
+            self._pending_results.put_nowait((session, sources, len(frames), future))
+
+    async def _collect_results(self) -> None:
+        while True:
+            try:
+                session, sources, submitted, future = await self._pending_results.get()
+            except asyncio.CancelledError:
+                self.logger.info("Image result collector task cancelled.")
+                break
+
+            images = []
+            if future is not None:
+                try:
+                    images = await future
+                except asyncio.CancelledError:
+                    self.logger.info("Image result collector task cancelled.")
+                    break
+                except Exception as e:
+                    self.stats.frames_failed += len(sources)
+                    self.logger.error(f"Error processing image batch: {e}")
+                    continue
+                finally:
+                    self._frames_in_flight -= submitted
+                    for _ in range(submitted):
+                        self._in_flight.release()
+
+            now = time.monotonic()
+            for enqueued_at, index, repeat_data in sources:
+                if repeat_data is None:
+                    image = images[index]
+                    if image is not None and session == self._session:
+                        self._last_analysed_image = image
+                else:
+                    source = images[index] if index is not None else self._last_analysed_image
+                    image = None
+                    if source is not None:
+                        self.stats.reuse_hits += 1
+                        image = Image(image_data=bytes(repeat_data), faces_detected=source.faces_detected)
+
+                if image is None:
+                    self.stats.frames_failed += 1
+                    self.logger.error("Error processing image: Invalid image data")
+                    continue
+
+                self.stats.record_latency(now - enqueued_at)
+
+                if session != self._session:
+                    self.stats.frames_discarded += 1
+                    continue
+
+                self._put_processed_image(image)
+
+                if repeat_data is not None:
+                    # Same scene as a frame already counted, it doesn't confirm a person a second time
+                    continue
 
                 if image.faces_detected:
-                    await self._faces_detected_images.put(image)
-                    self.num_of_face_detected_images += 1
-                    self.logger.info(f"Face detected in image: {image.image_name}")
+                    try:
+                        self._faces_detected_images.put_nowait(image)
+                        self.num_of_face_detected_images += 1
+                        self.logger.info(f"Face detected in image: {image.image_name}")
+                    except asyncio.QueueFull:
+                        self.logger.warning(f"Face detected image queue is full. Image dropped: {image.image_name}")
                 else:
                     self.logger.info(f"No face detected in image: {image.image_name}")
-            except Exception as e:
-                self.logger.error(f"Error processing image: {e}")
+
+    def _put_processed_image(self, image: Image) -> None:
+        # Nobody may be waiting on the processed queue, so make room by dropping the oldest result
+        if self._processed_image_queue.full():
+            self._processed_image_queue.get_nowait()
+            self._processed_image_queue.task_done()
+        self._processed_image_queue.put_nowait(image)
 
     async def dequeue_processed_image(self) -> Image:
         processed_image = await self._processed_image_queue.get()
@@ -66,8 +287,22 @@ class ImageQueue:
                 break
         return faces_detected_images
 
+    @staticmethod
+    def _drain(queue: asyncio.Queue) -> None:
+        while True:
+            try:
+                queue.get_nowait()
+                queue.task_done()
+            except asyncio.QueueEmpty:
+                break
+
     async def cleanup(self):
-        self._unprocessed_image_queue = asyncio.Queue()
-        self._processed_image_queue = asyncio.Queue()
-        self._faces_detected_images = asyncio.Queue()
+        # Drain instead of replacing the queues: the consumer and collector tasks are waiting on them
+        self._session += 1
+        self._last_thumbnail = None
+        self._last_analysed_image = None
+        self._drain(self._unprocessed_image_queue)
+        self._drain(self._processed_image_queue)
+        self._drain(self._faces_detected_images)
         self.num_of_face_detected_images = 0
+        self.logger.info(f"Image queue cleaned up. Stats: {self.get_stats()}")
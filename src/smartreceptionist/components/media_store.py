@@ -0,0 +1,237 @@
+import asyncio
+import concurrent.futures
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+
+from .config import Config
+
+_id_lock = threading.Lock()
+_last_media_id = 0
+
+
+def new_media_id() -> int:
+    """Microseconds since the epoch, strictly increasing within the process even if the clock steps back."""
+
+    global _last_media_id
+    with _id_lock:
+        _last_media_id = max(time.time_ns() // 1000, _last_media_id + 1)
+        return _last_media_id
+
+
+def _reserve_media_ids_up_to(media_id: int) -> None:
+    global _last_media_id
+    with _id_lock:
+        _last_media_id = max(_last_media_id, media_id)
+
+
+def media_name(media_id: int) -> str:
+    seconds, micros = divmod(media_id, 1_000_000)
+    return f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(seconds))}-{micros:06d}"
+
+
+def media_path(media_type: str, origin: str, media_id: int, suffix: str) -> Path:
+    base_dir = Path(Config.MEDIA_DIR)
+    if media_type == "audio":
+        return base_dir / "audio" / f"{origin}_received" / f"{media_name(media_id)}{suffix}"
+    return base_dir / f"{media_type}s" / f"{media_name(media_id)}{suffix}"
+
+
+@dataclass(frozen=True)
+class MediaEntry:
+    media_id: int
+    media_type: str  # "image" or "audio"
+    origin: str  # "esp" or "tg"
+    path: Path
+    created_at: float  # time.time()
+    session: str | None = None  # Groups media that belong together, e.g. the images of one visit
+    size: int = 0
+
+    @property
+    def name(self) -> str:
+        return media_name(self.media_id)
+
+
+class MediaStore:
+    """
+    Saved images and audio, indexed in memory so the latest entry of a type, or all entries of a type or session, are
+    found without touching the disk. The index is persisted in SQLite. Files and the database are only accessed from one
+    dedicated thread, off the event loop. Old entries are removed in the background once they are older than
+    retention_days or there are more than max_entries of the same type and origin.
+    """
+
+    def __init__(
+        self,
+        db_path: str = Config.MEDIA_DB_PATH,
+        retention_days: float = Config.MEDIA_RETENTION_DAYS,
+        max_entries: int = Config.MEDIA_MAX_ENTRIES,
+        retention_interval: float = Config.MEDIA_RETENTION_INTERVAL,
+    ):
+        self.logger = logging.getLogger(__name__)
+        self.db_path = Path(db_path)
+        self.retention_days = retention_days
+        self.max_entries = max_entries
+        self.retention_interval = retention_interval
+
+        self._io_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="media-store")
+        self._db: sqlite3.Connection | None = None
+        self._retention_task: asyncio.Task | None = None
+
+        self._entries: dict[int, MediaEntry] = {}
+        # Keyed by (media_type, origin) and (media_type, None), in the order entries were saved
+        self._by_kind: dict[tuple[str, str | None], OrderedDict[int, MediaEntry]] = {}
+        self._by_session: dict[str, dict[int, MediaEntry]] = {}
+
+    async def _run_io(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._io_pool, func, *args)
+
+    async def open(self) -> None:
+        rows = await self._run_io(self._open_sync)
+        for media_id, media_type, origin, session, path, size, created_at in rows:
+            self._index(MediaEntry(media_id, media_type, origin, Path(path), created_at, session, size))
+        if rows:
+            _reserve_media_ids_up_to(rows[-1][0])
+
+        self._retention_task = asyncio.create_task(self._retention_loop())
+        self.logger.info(f"Media store opened with {len(self._entries)} entries.")
+
+    def _open_sync(self) -> list[tuple]:
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS media ("
+            "id INTEGER PRIMARY KEY, media_type TEXT NOT NULL, origin TEXT NOT NULL, session TEXT, "
+            "path TEXT NOT NULL, size INTEGER NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        return self._db.execute(
+            "SELECT id, media_type, origin, session, path, size, created_at FROM media ORDER BY id"
+        ).fetchall()
+
+    async def close(self) -> None:
+        if self._retention_task:
+            self._retention_task.cancel()
+            await asyncio.gather(self._retention_task, return_exceptions=True)
+        if self._db:
+            await self._run_io(self._db.close)
+        self._io_pool.shutdown(wait=True)
+
+    @staticmethod
+    def new_session() -> str:
+        return f"session-{new_media_id()}"
+
+    async def save(
+        self,
+        data: bytes,
+        media_type: str,
+        origin: str,
+        suffix: str,
+        session: str | None = None,
+        media_id: int | None = None,
+    ) -> MediaEntry:
+        """Writes the file and indexes it. media_id can be allocated beforehand with new_media_id()."""
+
+        media_id = media_id or new_media_id()
+        entry = MediaEntry(
+            media_id=media_id,
+            media_type=media_type,
+            origin=origin,
+            path=media_path(media_type, origin, media_id, suffix),
+            created_at=time.time(),
+            session=session,
+            size=len(data),
+        )
+        await self._run_io(self._save_sync, entry, data)
+        self._index(entry)
+        return entry
+
+    def _save_sync(self, entry: MediaEntry, data: bytes) -> None:
+        entry.path.parent.mkdir(parents=True, exist_ok=True)
+        entry.path.write_bytes(data)
+        self._db.execute(
+            "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                entry.media_id,
+                entry.media_type,
+                entry.origin,
+                entry.session,
+                str(entry.path),
+                entry.size,
+                entry.created_at,
+            ),
+        )
+        self._db.commit()
+
+    def _index(self, entry: MediaEntry) -> None:
+        self._entries[entry.media_id] = entry
+        for kind in ((entry.media_type, entry.origin), (entry.media_type, None)):
+            self._by_kind.setdefault(kind, OrderedDict())[entry.media_id] = entry
+        if entry.session:
+            self._by_session.setdefault(entry.session, {})[entry.media_id] = entry
+
+    def _unindex(self, entry: MediaEntry) -> None:
+        self._entries.pop(entry.media_id, None)
+        for kind in ((entry.media_type, entry.origin), (entry.media_type, None)):
+            self._by_kind.get(kind, {}).pop(entry.media_id, None)
+        if entry.session:
+            session_entries = self._by_session.get(entry.session, {})
+            session_entries.pop(entry.media_id, None)
+            if not session_entries:
+                self._by_session.pop(entry.session, None)
+
+    def get(self, media_id: int) -> MediaEntry | None:
+        return self._entries.get(media_id)
+
+    def latest(self, media_type: str, origin: str | None = None) -> MediaEntry | None:
+        entries = self._by_kind.get((media_type, origin))
+        return next(reversed(entries.values())) if entries else None
+
+    def by_type(self, media_type: str, origin: str | None = None) -> list[MediaEntry]:
+        return list(self._by_kind.get((media_type, origin), {}).values())
+
+    def by_session(self, session: str) -> list[MediaEntry]:
+        return list(self._by_session.get(session, {}).values())
+
+    async def _retention_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.retention_interval)
+            try:
+                await self.apply_retention()
+            except Exception as e:
+                self.logger.error(f"Error applying media retention: {e}")
+
+    async def apply_retention(self) -> int:
+        """Removes expired and excess entries and their files. Returns how many were removed."""
+
+        cutoff = time.time() - self.retention_days * 24 * 60 * 60
+        expired = {}
+        for (media_type, origin), entries in self._by_kind.items():
+            if origin is None:
+                continue
+            excess = len(entries) - self.max_entries
+            for index, entry in enumerate(entries.values()):
+                if index < excess or entry.created_at < cutoff:
+                    expired[entry.media_id] = entry
+                else:
+                    break  # Entries are in save order, the rest are newer
+
+        if not expired:
+            return 0
+
+        # Unindexed first, so lookups stop returning them before the files are gone
+        for entry in expired.values():
+            self._unindex(entry)
+        await self._run_io(self._remove_sync, list(expired.values()))
+        self.logger.info(f"Removed {len(expired)} media entries past retention.")
+        return len(expired)
+
+    def _remove_sync(self, entries: list[MediaEntry]) -> None:
+        for entry in entries:
+            entry.path.unlink(missing_ok=True)
+        self._db.executemany("DELETE FROM media WHERE id = ?", [(entry.media_id,) for entry in entries])
+        self._db.commit()
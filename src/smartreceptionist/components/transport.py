@@ -0,0 +1,100 @@
+from dataclasses import dataclass
+from urllib.parse import parse_qs, urlsplit
+
+from websockets import WebSocketServerProtocol
+from websockets.datastructures import Headers
+
+from .config import Config
+
+
+@dataclass(frozen=True)
+class TransportProfile:
+    compression: bool  # permessage-deflate, wasted on JPEG frames and PCM
+    max_size: int | None  # Largest incoming message in bytes
+    write_limit: int  # Write buffer high-water mark in bytes, sends wait for the buffer to drain past it
+    ping_interval: float | None  # Keepalive, also what the RTT measurement comes from
+    ping_timeout: float | None
+
+
+PROFILES = {
+    # Large JPEG frames in, small commands out
+    "esp_cam": TransportProfile(
+        compression=False,
+        max_size=Config.CAM_MAX_FRAME_SIZE,
+        write_limit=64 * 1024,
+        ping_interval=20,
+        ping_timeout=20,
+    ),
+    # PCM both ways, a small write buffer keeps the paced speaker stream from piling up in the socket
+    "esp_s3": TransportProfile(
+        compression=False,
+        max_size=256 * 1024,
+        write_limit=16 * 1024,
+        ping_interval=10,
+        ping_timeout=10,
+    ),
+}
+
+# Connections that don't announce a role. The current ESP firmware connects to the bare URL and only says what it is
+# in its init message, after compression has been negotiated, so these aren't compressed either. The other limits are
+# the library defaults until init picks the device's profile.
+DEFAULT_PROFILE = TransportProfile(
+    compression=False,
+    max_size=2**20,
+    write_limit=2**16,
+    ping_interval=20,
+    ping_timeout=20,
+)
+
+
+def profile_for(role: str | None) -> TransportProfile:
+    return PROFILES.get(role, DEFAULT_PROFILE)
+
+
+def role_from_request(path: str, headers: Headers) -> str | None:
+    """
+    A device can announce its role in the URL path (/esp_cam), the X-Device-Role header, or ?role=esp_cam. They are
+    checked in that order, and the first one that names a known role wins.
+    """
+
+    url = urlsplit(path)
+    candidates = (url.path.strip("/"), headers.get("X-Device-Role"), parse_qs(url.query).get("role", [None])[0])
+    return next((role for role in candidates if role in PROFILES), None)
+
+
+def serve_options() -> dict:
+    """
+    websockets.serve() settings loose enough for every profile. Compression is then refused per connection during the
+    handshake, the rest is tightened per connection with apply_profile() once the device has identified itself.
+    """
+
+    profiles = [*PROFILES.values(), DEFAULT_PROFILE]
+    max_sizes = [profile.max_size for profile in profiles]
+    ping_intervals = [profile.ping_interval for profile in profiles if profile.ping_interval]
+    ping_timeouts = [profile.ping_timeout for profile in profiles if profile.ping_timeout]
+    return {
+        "compression": "deflate" if any(profile.compression for profile in profiles) else None,
+        "max_size": None if None in max_sizes else max(max_sizes),
+        "write_limit": max(profile.write_limit for profile in profiles),
+        # Keepalive has to run from the start to be adjustable later, apply_profile() only changes its timing
+        "ping_interval": min(ping_intervals) if ping_intervals else None,
+        "ping_timeout": max(ping_timeouts) if ping_timeouts else None,
+        "process_request": process_request,
+    }
+
+
+async def process_request(path: str, request_headers: Headers):
+    # Without the offer in the request headers the server doesn't negotiate permessage-deflate for this connection
+    if not profile_for(role_from_request(path, request_headers)).compression:
+        if "Sec-WebSocket-Extensions" in request_headers:
+            del request_headers["Sec-WebSocket-Extensions"]
+    return None  # Carry on with the handshake
+
+
+def apply_profile(websocket: WebSocketServerProtocol, profile: TransportProfile) -> None:
+    websocket.max_size = profile.max_size
+    if websocket.ping_interval is not None and profile.ping_interval is not None:
+        # Keepalive can't be switched on or off once the connection is open, only retimed
+        websocket.ping_interval = profile.ping_interval
+    websocket.ping_timeout = profile.ping_timeout
+    websocket.transport.set_write_buffer_limits(high=profile.write_limit, low=profile.write_limit // 4)
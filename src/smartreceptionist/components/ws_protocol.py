@@ -0,0 +1,143 @@
+import struct
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import NamedTuple
+
+from .config import Config
+
+# magic, version, frame type, flags, reserved, sequence number, device timestamp (ms), payload length, little-endian
+HEADER = struct.Struct("<2sBBBxIII")
+MAGIC = b"SR"
+PROTOCOL_VERSION = 1
+SEQUENCE_MASK = 0xFFFFFFFF
+
+
+class FrameType(IntEnum):
+    AUDIO = 1
+    IMAGE = 2
+    JSON = 3  # A control message, same content as the JSON text frames
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class Frame(NamedTuple):
+    frame_type: FrameType
+    flags: int
+    sequence: int
+    timestamp: int
+    payload: memoryview  # Slice of the received message, not a copy
+
+
+def is_binary_frame(message: bytes) -> bool:
+    return message[:2] == MAGIC
+
+
+def parse_frame(message: bytes) -> Frame:
+    if len(message) < HEADER.size:
+        raise ProtocolError(f"Frame shorter than its {HEADER.size} byte header")
+
+    magic, version, frame_type, flags, sequence, timestamp, length = HEADER.unpack_from(message)
+    if magic != MAGIC:
+        raise ProtocolError("Bad frame magic")
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version: {version}")
+    if length != len(message) - HEADER.size:
+        raise ProtocolError(f"Payload length {len(message) - HEADER.size} doesn't match the header ({length})")
+    try:
+        frame_type = FrameType(frame_type)
+    except ValueError:
+        raise ProtocolError(f"Unknown frame type: {frame_type}")
+
+    return Frame(frame_type, flags, sequence, timestamp, memoryview(message)[HEADER.size :])
+
+
+def build_frame(frame_type: FrameType, sequence: int, timestamp: int, payload: bytes, flags: int = 0) -> bytes:
+    header = HEADER.pack(MAGIC, PROTOCOL_VERSION, frame_type, flags, sequence & SEQUENCE_MASK, timestamp, len(payload))
+    return header + payload
+
+
+@dataclass
+class SequenceStats:
+    received: int = 0
+    lost: int = 0  # Never arrived, skipped once the reorder window was exceeded
+    reordered: int = 0  # Arrived ahead of a missing frame and were held back
+    late: int = 0  # Arrived after their place was given up, dropped
+    duplicates: int = 0
+
+
+@dataclass
+class ReorderBuffer:
+    """
+    Puts frames back in sequence order. Frames arriving ahead of a missing one are held until it arrives, or until more
+    than window frames are held, at which point the missing ones are counted as lost and skipped. A window of 0 only
+    counts losses.
+    """
+
+    window: int
+    stats: SequenceStats = field(default_factory=SequenceStats)
+    _expected: int | None = None
+    _held: dict[int, memoryview] = field(default_factory=dict)
+
+    def _distance(self, sequence: int) -> int:
+        return (sequence - self._expected) & SEQUENCE_MASK
+
+    def _release(self) -> list[memoryview]:
+        ready = []
+        while self._expected in self._held:
+            ready.append(self._held.pop(self._expected))
+            self._expected = (self._expected + 1) & SEQUENCE_MASK
+        return ready
+
+    def push(self, sequence: int, payload: memoryview) -> list[memoryview]:
+        """Returns the payloads that are now ready, in order."""
+
+        self.stats.received += 1
+        if self._expected is None:
+            self._expected = sequence
+
+        distance = self._distance(sequence)
+        if distance > SEQUENCE_MASK // 2:  # Behind the expected frame
+            self.stats.late += 1
+            return []
+        if sequence in self._held:
+            self.stats.duplicates += 1
+            return []
+
+        self._held[sequence] = payload
+        if distance:
+            self.stats.reordered += 1
+        if len(self._held) > self.window and self._expected not in self._held:
+            self._skip_to(min(self._held, key=self._distance))
+        return self._release()
+
+    def _skip_to(self, sequence: int) -> None:
+        self.stats.lost += self._distance(sequence)
+        self.stats.reordered -= 1  # The frame skipped to is simply next now
+        self._expected = sequence
+
+    def flush(self) -> list[memoryview]:
+        """Releases everything held, skipping over the gaps."""
+
+        ready = []
+        while self._held:
+            self._skip_to(min(self._held, key=self._distance))
+            ready += self._release()
+        return ready
+
+
+@dataclass
+class ProtocolSession:
+    """Per connection state of the binary protocol, enabled once the device asks for it in its init message."""
+
+    version: int | None = None
+    audio: ReorderBuffer = field(default_factory=lambda: ReorderBuffer(Config.AUDIO_REORDER_WINDOW))
+    images: ReorderBuffer = field(default_factory=lambda: ReorderBuffer(0))
+
+    def negotiate(self, requested) -> int | None:
+        """Takes the init message's "protocol" value, a version or a list of them. Returns the accepted version."""
+
+        versions = requested if isinstance(requested, list) else [requested]
+        self.version = PROTOCOL_VERSION if PROTOCOL_VERSION in versions else None
+        return self.version
@@ -1,17 +1,19 @@
 import asyncio
 import json
 import logging
-import wave
 from dataclasses import dataclass
-from pathlib import Path
 from typing import Literal
 
 from websockets import ConnectionClosed, WebSocketServerProtocol
 
 from .app_state import AppState, ESPState
-from .config import Config
+from .audio_processing.audio_queue import AudioQueue
+from .audio_streamer import AudioStreamer, AudioStreamStats
+from .device_registry import ConnectionStats, DeviceRegistry
 from .events.event import Event, EventType, Origin
 from .events.event_listener import EventListener
+from .transport import apply_profile, profile_for
+from .ws_protocol import FrameType, ProtocolError, ProtocolSession, is_binary_frame, parse_frame
 
 
 @dataclass
@@ -32,6 +34,17 @@ class WSMessage:
         return cls(event_type=event_type, data=data.get("data", {}))
 
 
+@dataclass
+class AudioIngestStats:
+    chunks: int = 0
+    bytes: int = 0
+    dropped_chunks: int = 0
+    dropped_bytes: int = 0
+
+    def __str__(self):
+        return f"{self.chunks} chunks / {self.bytes} bytes, {self.dropped_chunks} chunks / {self.dropped_bytes} bytes dropped"
+
+
 class WSMessageEncoder(json.JSONEncoder):
     def default(self, o):
         if isinstance(o, WSMessage):
@@ -39,102 +52,198 @@ class WSMessageEncoder(json.JSONEncoder):
         return super().default(o)
 
 
+# Messages without data (capture_image, grant_access, reset_device, ...) never change, so they are serialized once
+COMMANDS = {event_type: json.dumps({"event_type": event_type.value, "data": {}}) for event_type in EventType}
+
+
+def encode_message(message: WSMessage) -> str:
+    """Same output as json.dumps(message, cls=WSMessageEncoder), from the command table when the message has no data."""
+
+    if not message.data:
+        return COMMANDS[message.event_type]
+    return json.dumps({"event_type": message.event_type.value, "data": message.data})
+
+
 class WebSocketServer:
-    def __init__(self, event_listener: EventListener, app_state: AppState):
+    def __init__(
+        self,
+        event_listener: EventListener,
+        app_state: AppState,
+        audio_queue: AudioQueue,
+    ):
         self.app_state = app_state
         self.event_listener = event_listener
-        self.connected_devices = {}
+        self.audio_queue = audio_queue
+        self.devices = DeviceRegistry()
+        self.audio_streamer: AudioStreamer | None = None  # The stream to the speaker currently playing, if any
         self.logger = logging.getLogger(__name__)
 
     async def send(self, device: Literal["esp_cam", "esp_s3"], message: WSMessage):
-        for websocket, device_name in self.connected_devices.items():
-            if device_name == device:
-                try:
-                    await websocket.send(json.dumps(message, cls=WSMessageEncoder))
-                    self.logger.info(f"Sent message to {device}: {message}")
-                except ConnectionClosed:
-                    self.logger.warning(f"Failed to send to {device}: connection closed.")
-
-    async def _handle_init_message(self, message: WSMessage, websocket: WebSocketServerProtocol):
+        if not self.devices.is_connected(device):
+            return
+
+        # Serialized once, however many sockets the device has
+        if await self.devices.broadcast(device, encode_message(message)):
+            self.logger.info(f"Sent message to {device}: {message}")
+
+    async def _handle_init_message(
+        self,
+        message: WSMessage,
+        websocket: WebSocketServerProtocol,
+        protocol: ProtocolSession,
+        connection_stats: ConnectionStats,
+    ):
         device_name = message.data["device"]
         if device_name in ("esp_cam", "esp_s3"):
-            self.connected_devices[websocket] = device_name
+            self.devices.add(websocket, device_name, message.data.get("device_id"), connection_stats)
+            apply_profile(websocket, profile_for(device_name))
             setattr(self.app_state, f"{device_name}_state", ESPState.CONNECTED)
             self.logger.info(f"{device_name} connected.")
+            await self.event_listener.enqueue_event(Event(EventType.INIT, Origin.ESP, {"device": device_name}))
+
+        if "protocol" in message.data:
+            # The device offers the binary framing, legacy JSON and prefixed frames keep working either way. The ack
+            # goes out after registration so it is counted in the connection's stats.
+            version = protocol.negotiate(message.data["protocol"])
+            ack = encode_message(WSMessage(EventType.INIT, {"action": "ack", "protocol": version}))
+            await self.devices.sender(websocket)(ack)
+            if version is None:
+                self.logger.warning(f"No common binary protocol version with {websocket.remote_address}, using JSON only")
+            else:
+                self.logger.info(f"Binary protocol version {version} negotiated with {websocket.remote_address}")
+
+    async def stream_audio(self, chunks) -> AudioStreamStats | None:
+        """
+        Streams 16-bit mono PCM at the configured sample rate to the ESP32-S3 speaker, paced to playback speed. Returns the
+        stream statistics, or None if the device isn't connected.
+        """
 
-    async def start_prefetching(self, audio_file_path: Path):
         device_name = "esp_s3"
-        websocket = next((ws for ws, name in self.connected_devices.items() if name == device_name), None)
+        websocket = self.devices.first(device_name)
         if not websocket:
             self.logger.warning(f"No connected websocket found for device: {device_name}")
             return
 
+        streamer = self.audio_streamer = AudioStreamer(self.devices.sender(websocket))
         try:
             self.logger.info(f"Started streaming audio to {websocket.remote_address}")
             await self.send("esp_s3", WSMessage(event_type=EventType.AUDIO, data={"action": "start_prefetch"}))
-
-            with wave.open(str(audio_file_path), "rb") as wav_file:
-                if wav_file.getnchannels() != 1 or wav_file.getsampwidth() != 2 or wav_file.getframerate() != Config.SAMPLE_RATE:
-                    raise ValueError(f"Unexpected WAV format. Expected: 1 channel, 16-bit, {Config.SAMPLE_RATE}Hz")
-
-                # Skip the WAV header (44 bytes for standard WAV files)
-                wav_file.setpos(44 // wav_file.getsampwidth())
-
-                while True:
-                    chunk = wav_file.readframes(Config.DEFAULT_CHUNK_SIZE // 2)
-                    if not chunk:
-                        break
-
-                    await websocket.send(chunk)
-                    await asyncio.sleep(0.01)
-
+            stats = await streamer.stream(chunks)
             await self.send("esp_s3", WSMessage(event_type=EventType.AUDIO, data={"action": "stop_prefetch"}))
-            self.logger.info(f"Finished streaming audio to {websocket.remote_address}")
+            self.logger.info(f"Finished streaming audio to {websocket.remote_address}: {stats}")
         except ConnectionClosed:
             self.logger.warning(f"Connection closed by client {websocket.remote_address} during audio streaming.")
-        except Exception as e:
-            self.logger.error(f"Error during audio streaming: {e}")
+        finally:
+            if self.audio_streamer is streamer:
+                self.audio_streamer = None
+        return streamer.stats
 
-    async def handle_events(self, message: WSMessage, websocket: WebSocketServerProtocol):
+    async def handle_events(
+        self,
+        message: WSMessage,
+        websocket: WebSocketServerProtocol,
+        protocol: ProtocolSession,
+        audio_stats: AudioIngestStats,
+        connection_stats: ConnectionStats,
+    ):
         if message.event_type == EventType.INIT:
-            await self._handle_init_message(message, websocket)
+            await self._handle_init_message(message, websocket, protocol, connection_stats)
+        elif message.event_type == EventType.AUDIO and message.data.get("action") == "ack":
+            # Flow control for the stream to the speaker, handled here rather than on the event bus
+            if self.audio_streamer:
+                self.audio_streamer.handle_ack(message.data)
         else:
+            if message.event_type == EventType.RECORDING_SENT:
+                # Chunks still held back waiting for a lost one belong to this recording
+                for chunk in protocol.audio.flush():
+                    self.handle_audio_chunk(chunk, audio_stats)
             await self.event_listener.enqueue_event(Event(message.event_type, Origin.ESP, message.data))
 
-    async def handle_audio_chunk(self, message: bytes, _: WebSocketServerProtocol):
-        await self.event_listener.enqueue_event(
-            Event(event_type=EventType.AUDIO_DATA, origin=Origin.ESP, data={"audio": message})
-        )
+    async def _handle_json(
+        self,
+        message: bytes,
+        websocket: WebSocketServerProtocol,
+        protocol: ProtocolSession,
+        audio_stats: AudioIngestStats,
+        connection_stats: ConnectionStats,
+    ):
+        try:
+            message_dict = json.loads(message)
+            ws_message = WSMessage.from_dict(message_dict)
+            self.logger.info(f"Received message: {ws_message}")
+            await self.handle_events(ws_message, websocket, protocol, audio_stats, connection_stats)
+        except json.JSONDecodeError:
+            self.logger.warning("Invalid JSON message received")
+        except ValueError as e:
+            self.logger.warning(f"Invalid message format: {e}")
 
-    async def handle_image_data(self, message: bytes, _: WebSocketServerProtocol):
+    async def _handle_frame(
+        self,
+        message: bytes,
+        websocket: WebSocketServerProtocol,
+        protocol: ProtocolSession,
+        audio_stats: AudioIngestStats,
+        connection_stats: ConnectionStats,
+    ):
+        try:
+            frame = parse_frame(message)
+        except ProtocolError as e:
+            self.logger.warning(f"Invalid binary frame: {e}")
+            return
+
+        if frame.frame_type == FrameType.AUDIO:
+            for chunk in protocol.audio.push(frame.sequence, frame.payload):
+                self.handle_audio_chunk(chunk, audio_stats)
+        elif frame.frame_type == FrameType.IMAGE:
+            for image in protocol.images.push(frame.sequence, frame.payload):
+                _ = asyncio.create_task(self.handle_image_data(image, websocket))
+        else:
+            await self._handle_json(bytes(frame.payload), websocket, protocol, audio_stats, connection_stats)
+
+    def handle_audio_chunk(self, message: memoryview, stats: AudioIngestStats):
+        # Appended straight into the recording, without a task or the event bus, so chunks stay in arrival order and
+        # are all in before any later message on this connection (like recording_sent) is handled. The recording
+        # buffer is capped, chunks past the cap are dropped and counted.
+        if self.audio_queue.add_audio_chunk_nowait(message):
+            stats.chunks += 1
+            stats.bytes += len(message)
+        else:
+            stats.dropped_chunks += 1
+            stats.dropped_bytes += len(message)
+
+    async def handle_image_data(self, message: memoryview, _: WebSocketServerProtocol):
         await self.event_listener.enqueue_event(
             Event(event_type=EventType.IMAGE_DATA, origin=Origin.ESP, data={"image": message})
         )
 
     async def handle_new_connection(self, websocket: WebSocketServerProtocol):
         self.logger.info(f"Websocket client connected: {websocket.remote_address}")
+        audio_stats = AudioIngestStats()
+        protocol = ProtocolSession()
+        connection_stats = ConnectionStats()
 
         try:
             async for message in websocket:
                 if isinstance(message, str):  # Check if it's a string
                     message = message.encode("utf-8")  # Encode to bytes
+                connection_stats.record_in(len(message))
 
                 # Directly check if message starts with JSON opening brace '{'
                 if message.startswith(b"{"):
-                    try:
-                        message_dict = json.loads(message.decode("utf-8"))
-                        ws_message = WSMessage.from_dict(message_dict)
-                        self.logger.info(f"Received message: {ws_message}")
-                        await self.handle_events(ws_message, websocket)
-                    except json.JSONDecodeError:
-                        self.logger.warning("Invalid JSON message received")
-                    except ValueError as e:
-                        self.logger.warning(f"Invalid message format: {e}")
+                    await self._handle_json(message, websocket, protocol, audio_stats, connection_stats)
+
+                elif protocol.version and is_binary_frame(message):
+                    await self._handle_frame(message, websocket, protocol, audio_stats, connection_stats)
 
                 else:  # Raw data
-                    prefix, data = message.split(b":", 1)
+                    # Slice the payload as a view instead of split() copying the whole frame
+                    separator = message.find(b":", 0, 8)
+                    if separator == -1:
+                        self.logger.warning("Raw data received without a type prefix")
+                        continue
+                    prefix, data = message[:separator], memoryview(message)[separator + 1 :]
                     if prefix == b"AUDIO":
-                        _ = asyncio.create_task(self.handle_audio_chunk(data, websocket))
+                        self.handle_audio_chunk(data, audio_stats)
                     elif prefix == b"IMAGE":
                         _ = asyncio.create_task(self.handle_image_data(data, websocket))
                     else:
@@ -144,9 +253,18 @@ class WebSocketServer:
             self.logger.warning(f"Connection closed unexpectedly: {e.code} - {e.reason}")
         finally:
             self.logger.info(f"Websocket client disconnected: {websocket.remote_address}")
+            for chunk in protocol.audio.flush():
+                self.handle_audio_chunk(chunk, audio_stats)
+            if protocol.version:
+                self.logger.info(
+                    f"Binary frames from {websocket.remote_address}: audio {protocol.audio.stats}, images {protocol.images.stats}"
+                )
+            if audio_stats.chunks or audio_stats.dropped_chunks:
+                self.logger.info(f"Audio received from {websocket.remote_address}: {audio_stats}")
 
             # Clean up connected devices
-            if websocket in self.connected_devices:
-                device_name = self.connected_devices.pop(websocket)
-                setattr(self.app_state, f"{device_name}_state", ESPState.DISCONNECTED)
-                self.logger.info(f"{device_name} disconnected.")
+            connection = self.devices.remove(websocket)
+            if connection:
+                self.logger.info(f"{connection.name} disconnected: {connection.stats}, RTT {connection.rtt * 1000:.0f} ms.")
+                if not self.devices.is_connected(connection.name):
+                    setattr(self.app_state, f"{connection.name}_state", ESPState.DISCONNECTED)
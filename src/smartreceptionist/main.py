@@ -22,7 +22,9 @@ from components.events.event_listener import EventListener
 from components.google_home import GoogleHome
 from components.image_processing.image_processor import ImageProcessor
 from components.image_processing.image_queue import ImageQueue
+from components.media_store import MediaStore
 from components.telegram_bot import TelegramBot
+from components.transport import serve_options
 from components.ws_server import WebSocketServer
 
 
@@ -53,7 +55,7 @@ async def initialize_telegram_app(telegram_bot: TelegramBot):
 
 async def initialize_ws_server(ws_server: WebSocketServer):
     # For local development
-    ws_server_process = await websockets.serve(ws_server.handle_new_connection, "0.0.0.0", 8765)
+    ws_server_process = await websockets.serve(ws_server.handle_new_connection, "0.0.0.0", 8765, **serve_options())
     return ws_server_process
 
 
@@ -97,28 +99,37 @@ async def main():
         event_listener=event_listener,
         app_state=app_state,
     )
-    audio_queue = AudioQueue()
     audio_processor = AudioProcessor()
-    ws_server = WebSocketServer(event_listener=event_listener, app_state=app_state)
+    audio_queue = AudioQueue(audio_processor=audio_processor)
+    ws_server = WebSocketServer(
+        event_listener=event_listener,
+        app_state=app_state,
+        audio_queue=audio_queue,
+    )
     google_home = GoogleHome(event_listener)
+    media_store = MediaStore()
 
     # Concurrent initialization of components
     init_tasks = [
         initialize_telegram_app(telegram_bot),
         initialize_ws_server(ws_server),
         initialize_sinric_pro(google_home.handle_set_mode, google_home.handle_power_state),
+        audio_processor.start(),
+        media_store.open(),
     ]
 
-    tg_app, ws_server_process, (sinric_pro_client, sinric_pro_task) = await asyncio.gather(*init_tasks)
+    tg_app, ws_server_process, (sinric_pro_client, sinric_pro_task), _, _ = await asyncio.gather(*init_tasks)
 
     event_handler = EventHandler(
         telegram_bot=telegram_bot,
         ws_server=ws_server,
         app_state=app_state,
         image_queue=image_queue,
+        image_processor=image_processor,
         sinric_pro_client=sinric_pro_client,
         audio_queue=audio_queue,
         audio_processor=audio_processor,
+        media_store=media_store,
     )
 
     # Start the event listener
@@ -160,6 +171,15 @@ async def main():
         await tg_app.stop()
         await tg_app.shutdown()
 
+        # Stop the image workers and release their shared memory
+        image_processor.close()
+
+        # Stop the ffmpeg transcoders and the audio DSP threads
+        await audio_processor.close()
+
+        # Stop media retention and close the media index
+        await media_store.close()
+
         # Wait for all tasks to complete
         await asyncio.gather(sinric_pro_task, event_listener_task, return_exceptions=True)
 
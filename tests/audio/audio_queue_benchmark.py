@@ -0,0 +1,50 @@
+import asyncio
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src" / "smartreceptionist"))
+
+from components.audio_processing.audio_processor import AudioProcessor  # noqa: E402
+from components.audio_processing.audio_queue import AudioQueue  # noqa: E402
+from components.config import Config  # noqa: E402
+
+CHUNK = bytes(Config.DEFAULT_CHUNK_SIZE)
+
+
+async def run(minutes: int) -> None:
+    """
+    Time the receive loop spends per chunk, and the wait for the WAV once the recording stops. Peak memory no longer
+    includes a copy of the raw recording, chunks only go through the stream.
+    """
+
+    queue = AudioQueue(AudioProcessor())
+    chunks = Config.SAMPLE_RATE * Config.BYTES_PER_SAMPLE * 60 * minutes // len(CHUNK)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(chunks):
+        queue.add_audio_chunk_nowait(CHUNK)
+        await asyncio.sleep(0)  # Let the background denoise blocks run, as the receive loop would
+    ingest = time.perf_counter() - start
+
+    start = time.perf_counter()
+    wav = await queue.get_processed_audio()
+    finish = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"{minutes} min: {queue.size / 1e6:6.1f} MB received, {ingest / chunks * 1e6:6.1f} us/chunk, "
+        f"WAV ({len(wav) / 1e6:.1f} MB) ready {finish * 1000:8.1f} ms after the last chunk, peak {peak / 1e6:6.1f} MB"
+    )
+
+
+async def main():
+    for minutes in (1, 5):
+        await run(minutes)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,43 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src" / "smartreceptionist"))
+
+from components.audio_processing.audio_processor import AudioProcessor  # noqa: E402
+from components.audio_processing.denoisers import DENOISER_TIERS, PassthroughDenoiser  # noqa: E402
+from components.config import Config  # noqa: E402
+
+AUDIO_DIR = Path(__file__).resolve().parent
+FORMATS = {".pcm": "pcm", ".opus": "opus", ".wav": "wav"}
+RUNS = 3
+
+
+def main():
+    audio_processor = AudioProcessor(denoiser=PassthroughDenoiser())
+
+    print(f"{'file':<24} {'length':>7} " + " ".join(f"{tier:>9}" for tier in DENOISER_TIERS))
+    for path in sorted(AUDIO_DIR.iterdir()):
+        input_format = FORMATS.get(path.suffix)
+        if input_format is None:
+            continue
+
+        audio_data = audio_processor.apply_filters(audio_processor.decode(path.read_bytes(), input_format))
+        seconds = len(audio_data) / Config.SAMPLE_RATE
+
+        real_time_factors = []
+        for denoiser_class in DENOISER_TIERS.values():
+            # A fresh denoiser per file, so the fast tier learns (and pays for) the noise profile on the first run
+            denoiser = denoiser_class()
+            start = time.perf_counter()
+            for _ in range(RUNS):
+                denoiser.denoise(audio_data, source=path.name)
+            real_time_factors.append((time.perf_counter() - start) / RUNS / seconds)
+
+        print(f"{path.name:<24} {seconds:>6.1f}s " + " ".join(f"{rtf:>9.4f}" for rtf in real_time_factors))
+
+    print(f"\nReal-time factor: denoise seconds per second of audio, averaged over {RUNS} runs. Lower is faster.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+from scipy import signal
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "src" / "smartreceptionist"))
+
+from components.audio_processing.audio_processor import AudioProcessor  # noqa: E402
+from components.config import Config  # noqa: E402
+
+DURATIONS = (10, 60, 300, 600)  # Seconds
+
+
+def previous_path(pcm: bytes) -> np.ndarray:
+    """Decode and filter the way AudioProcessor used to: float32 samples, then two float64 sosfilt passes."""
+
+    audio_data = np.array(np.frombuffer(pcm, dtype=np.int16), dtype=np.float32) / 32768.0
+    sos = signal.butter(5, 50, "hp", fs=Config.SAMPLE_RATE, output="sos")
+    audio_data = signal.sosfilt(sos, audio_data)
+    sos = signal.butter(5, 7000, "lp", fs=Config.SAMPLE_RATE, output="sos")
+    return signal.sosfilt(sos, audio_data)
+
+
+def current_path(audio_processor: AudioProcessor, pcm: bytes) -> np.ndarray:
+    return audio_processor.apply_filters(audio_processor.decode(pcm, "pcm"))
+
+
+def measure(func, *args) -> tuple[np.ndarray, float, int]:
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    audio_processor = AudioProcessor()
+    rng = np.random.default_rng(0)
+
+    print(f"{'duration':>8} {'path':<9} {'time':>10} {'peak':>10}")
+    for seconds in DURATIONS:
+        pcm = rng.integers(-8000, 8000, seconds * Config.SAMPLE_RATE, dtype=np.int16).tobytes()
+
+        previous, previous_time, previous_peak = measure(previous_path, pcm)
+        current, current_time, current_peak = measure(current_path, audio_processor, pcm)
+
+        print(f"{seconds:>7}s {'previous':<9} {previous_time * 1000:>8.1f}ms {previous_peak / 1e6:>8.1f}MB")
+        print(f"{seconds:>7}s {'current':<9} {current_time * 1000:>8.1f}ms {current_peak / 1e6:>8.1f}MB")
+        print(f"{'':>8} max abs difference {np.max(np.abs(previous - current)):.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "smartreceptionist"))
+
+from components.config import Config  # noqa: E402
+from components.events.event import Event, EventType, Origin  # noqa: E402
+from components.events.event_bus import Lane  # noqa: E402
+from components.events.event_listener import EventListener, Route  # noqa: E402
+
+CONTROL_TYPES = [EventType.CAMERA, EventType.ACCESS_CONTROL, EventType.RESET_DEVICE]
+
+
+class Handlers:
+    """Records the order handlers start in. Image handlers wait for the gate, control handlers return right away."""
+
+    def __init__(self, gate: asyncio.Event):
+        self.gate = gate
+        self.started = []
+
+    def routes(self) -> dict[EventType, Route]:
+        return {
+            EventType.IMAGE_DATA: Route(self.handle_image),
+            **{event_type: Route(self.handle_control) for event_type in CONTROL_TYPES},
+        }
+
+    async def handle_image(self, event: Event):
+        self.started.append(("image", event.data["n"]))
+        await self.gate.wait()
+
+    async def handle_control(self, event: Event):
+        self.started.append((event.event_type.value, event.data["n"]))
+
+
+def image(n: int) -> Event:
+    return Event(EventType.IMAGE_DATA, Origin.ESP, {"n": n})
+
+
+async def settle(iterations: int = 500) -> None:
+    for _ in range(iterations):
+        await asyncio.sleep(0)
+
+
+async def bulk_flood():
+    listener, gate = EventListener(), asyncio.Event()
+    handlers = Handlers(gate)
+    listen_task = asyncio.create_task(listener.listen(handlers))
+
+    # The serial image handler is blocked on the first frame
+    await listener.queue.put(image(0))
+    await settle()
+    assert handlers.started == [("image", 0)]
+
+    # Further frames wait in the bulk lane, and once it is full they are dropped
+    results = [await listener.queue.put(image(n)) for n in range(1, Config.BULK_LANE_SIZE + 6)]
+    assert results.count(False) == 5
+    assert listener.queue.depths()[Lane.BULK] == Config.BULK_LANE_SIZE
+    assert listener.queue.stats[Lane.BULK].dropped == 5
+
+    # Control events are still handled while the bulk backlog waits
+    for n, event_type in enumerate(CONTROL_TYPES):
+        assert await listener.queue.put(Event(event_type, Origin.ESP, {"n": n}))
+    await settle()
+    assert handlers.started[1:] == [(event_type.value, n) for n, event_type in enumerate(CONTROL_TYPES)]
+
+    gate.set()
+    await settle()
+    assert [n for kind, n in handlers.started if kind == "image"] == list(range(Config.BULK_LANE_SIZE + 1))
+    assert listener.queue.qsize() == 0
+
+    listen_task.cancel()
+    await listen_task
+
+
+async def control_first():
+    listener, gate = EventListener(), asyncio.Event()
+    gate.set()
+    handlers = Handlers(gate)
+
+    # Queued before the listener starts, bulk first
+    for n in range(8):
+        await listener.queue.put(image(n))
+    for n, event_type in enumerate(CONTROL_TYPES):
+        await listener.queue.put(Event(event_type, Origin.ESP, {"n": n}))
+
+    listen_task = asyncio.create_task(listener.listen(handlers))
+    await settle()
+    assert handlers.started[: len(CONTROL_TYPES)] == [(event_type.value, n) for n, event_type in enumerate(CONTROL_TYPES)]
+    assert handlers.started[len(CONTROL_TYPES) :] == [("image", n) for n in range(8)]
+
+    listen_task.cancel()
+    await listen_task
+
+
+def test_bulk_flood_is_bounded_while_handler_is_blocked():
+    asyncio.run(bulk_flood())
+
+
+def test_control_events_go_first():
+    asyncio.run(control_first())
+
+
+if __name__ == "__main__":
+    test_bulk_flood_is_bounded_while_handler_is_blocked()
+    test_control_events_go_first()
+    print("OK")
@@ -0,0 +1,55 @@
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src" / "smartreceptionist"))
+
+from components.device_registry import DeviceRegistry  # noqa: E402
+from components.events.event import EventType  # noqa: E402
+from components.ws_server import WSMessage, WSMessageEncoder, encode_message  # noqa: E402
+
+SENDS = 100_000
+
+MESSAGES = {
+    "capture_image": WSMessage(event_type=EventType.CAPTURE_IMAGE, data={}),
+    "grant_access": WSMessage(event_type=EventType.GRANT_ACCESS, data={}),
+    "enroll_fingerprint": WSMessage(event_type=EventType.ENROLL_FINGERPRINT, data={"id": 12}),
+}
+
+
+class NullWebSocket:
+    """Accepts sends without doing anything, so only the server side of a send is measured."""
+
+    remote_address = ("127.0.0.1", 0)
+
+    async def send(self, payload):
+        pass
+
+
+def previous_encode(message: WSMessage) -> str:
+    return json.dumps(message, cls=WSMessageEncoder)
+
+
+async def sends_per_second(encode, message: WSMessage, devices: DeviceRegistry) -> float:
+    start = time.perf_counter()
+    for _ in range(SENDS):
+        await devices.broadcast("esp_cam", encode(message))
+    return SENDS / (time.perf_counter() - start)
+
+
+async def main():
+    devices = DeviceRegistry()
+    devices.add(NullWebSocket(), "esp_cam")
+
+    print(f"{'message':<20} {'previous':>12} {'current':>12} {'speedup':>8}")
+    for name, message in MESSAGES.items():
+        assert encode_message(message) == previous_encode(message)
+        previous = await sends_per_second(previous_encode, message, devices)
+        current = await sends_per_second(encode_message, message, devices)
+        print(f"{name:<20} {previous:>10.0f}/s {current:>10.0f}/s {current / previous:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())